@@ -1,35 +1,131 @@
-import os
-import shutil
-
-# For this to work, you need to toggle on the option to transfer files over network on your Shield device
-# Under: settings > device preferences > storage > transfer files over local network
-
-SHIELD_FOLDER = r"\\YOUR SHIELD IP\internal\Pictures\Synced Wallpapers"  # Replace with the IP address of your Shield
-
-# Sync with Nvidia Shield folder
-def sync_folders(background_dir):
-    # First, check if SHIELD_FOLDER is accessible
-    try:
-        if not os.path.exists(SHIELD_FOLDER):
-            # Attempt to create the folder if it doesn't exist
-            os.makedirs(SHIELD_FOLDER)
-    except OSError as e:
-        # If the folder isn't accessible, abort sync
-        print(f"Error accessing Shield folder: {e}")
-        print("Sync aborted.")
-        return
-
-    # Copy new/updated files from background_dir to SHIELD_FOLDER
-    shutil.copytree(background_dir, SHIELD_FOLDER, dirs_exist_ok=True)
-
-    # Get the list of files in both the output and Shield folders
-    output_files = set(os.listdir(background_dir))
-    shield_files = set(os.listdir(SHIELD_FOLDER))
-
-    # Remove files from SHIELD_FOLDER that no longer exist in background_dir
-    for file_name in shield_files:
-        if file_name not in output_files:
-            shield_file_path = os.path.join(SHIELD_FOLDER, file_name)
-            if os.path.isfile(shield_file_path):
-                os.remove(shield_file_path)
-                print(f"Removed unused file from Shield: {file_name}")
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+import concurrency
+import fileutil
+import metrics
+
+# For this to work, you need to toggle on the option to transfer files over network on your Shield device
+# Under: settings > device preferences > storage > transfer files over local network
+
+SHIELD_FOLDER = r"\\YOUR SHIELD IP\internal\Pictures\Synced Wallpapers"  # Replace with the IP address of your Shield
+
+# Edit to set the number of files copied to the Shield at the same time
+SYNC_WORKERS = 4
+
+# What was last copied to each target is remembered here, so unchanged wallpapers are not sent again
+SYNC_MANIFEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "sync")
+
+
+def _manifest_path(background_dir: str, target_dir: str) -> str:
+    key = f"{os.path.abspath(background_dir)}\n{target_dir}"
+    return os.path.join(SYNC_MANIFEST_DIR, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json")
+
+
+def _load_manifest(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(path: str, entries: Dict[str, Dict]):
+    os.makedirs(SYNC_MANIFEST_DIR, exist_ok=True)
+    fileutil.atomic_write(path, json.dumps(entries, indent=1, sort_keys=True))
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _transfer(source_path: str, target_dir: str, file_name: str) -> Optional[Dict]:
+    """Copies a file atomically, so the launcher never shows half a wallpaper."""
+    stat = os.stat(source_path)
+    with open(source_path, "rb") as f:
+        data = f.read()
+    try:
+        fileutil.atomic_write(os.path.join(target_dir, file_name), data)
+    except OSError as e:
+        print(f"Error copying {file_name} to Shield: {e}")
+        return None
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha1": hashlib.sha1(data).hexdigest()}
+
+
+# Sync with Nvidia Shield folder
+def sync_folders(background_dir, target_dir=SHIELD_FOLDER, workers=SYNC_WORKERS):
+    """Copies new and changed wallpapers to the target folder and removes the ones no longer in background_dir.
+
+    The target can be the Shield share or any local folder. Returns the number of files and bytes moved.
+    """
+    with metrics.stage("sync"):
+        return _sync_folders(background_dir, target_dir, workers)
+
+
+def _sync_folders(background_dir, target_dir, workers):
+    # First, check if the target folder is accessible
+    try:
+        if not os.path.exists(target_dir):
+            # Attempt to create the folder if it doesn't exist
+            os.makedirs(target_dir)
+        # A single listing of the target tells which wallpapers are still there, e.g. after a reset of the device
+        target_files = {entry.name: entry.stat().st_size for entry in os.scandir(target_dir) if entry.is_file()}
+    except OSError as e:
+        # If the folder isn't accessible, abort sync
+        print(f"Error accessing Shield folder: {e}")
+        print("Sync aborted.")
+        return None
+
+    manifest_path = _manifest_path(background_dir, target_dir)
+    synced = _load_manifest(manifest_path)
+    entries = {}
+    pending = []
+    for entry in os.scandir(background_dir):
+        if not entry.is_file() or entry.name.endswith(".tmp"):
+            continue
+        stat = entry.stat()
+        previous = synced.get(entry.name)
+        if previous and target_files.get(entry.name) == previous["size"]:
+            if previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns:
+                entries[entry.name] = previous
+                continue
+            # Touched but maybe not changed, e.g. rendered again from the same inputs
+            if previous["size"] == stat.st_size and previous["sha1"] == _file_hash(entry.path):
+                entries[entry.name] = dict(previous, mtime=stat.st_mtime_ns)
+                continue
+        pending.append(entry.name)
+
+    # Copy the new and changed files in parallel
+    with concurrency.ThreadPool(max_workers=max(workers, 1)) as pool:
+        results = list(pool.map(lambda file_name: _transfer(os.path.join(background_dir, file_name), target_dir, file_name),
+                                pending))
+    copied_bytes = 0
+    copied = 0
+    for file_name, result in zip(pending, results):
+        if result:
+            entries[file_name] = result
+            copied_bytes += result["size"]
+            copied += 1
+
+    # Remove files from the target folder that no longer exist in background_dir
+    removed = 0
+    for file_name in target_files:
+        if file_name not in entries and file_name not in pending:
+            try:
+                os.remove(os.path.join(target_dir, file_name))
+                removed += 1
+                print(f"Removed unused file from Shield: {file_name}")
+            except OSError as e:
+                print(f"Error removing {file_name} from Shield: {e}")
+
+    _save_manifest(manifest_path, entries)
+    metrics.count("sync_files", copied, result="copied")
+    metrics.count("sync_files", len(entries) - copied, result="unchanged")
+    metrics.count("sync_files", removed, result="removed")
+    metrics.count("sync_bytes", copied_bytes)
+    print(f"Synced to Shield: {copied} files copied ({copied_bytes / 1024 / 1024:.1f} MB), "
+          f"{len(entries) - copied} unchanged, {removed} removed")
+    return {"copied": copied, "bytes": copied_bytes, "unchanged": len(entries) - copied, "removed": removed}
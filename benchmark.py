@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+import fonts
+import metrics
+
+# Runs each script end to end against local stand-ins for the TMDB, Trakt and Plex servers and reports how long
+# every stage took. Each run starts with empty caches in a temporary folder, so runs are comparable:
+#   python benchmark.py                                  all sources with the default item counts
+#   python benchmark.py --sources TMDB plex --counts 20 500 --latency 0.1 --json baseline.json
+# The Plex run needs plexapi installed.
+
+# Edit to change the default item counts and the latency the stand-in servers add to every response, in seconds
+ITEM_COUNTS = (20, 100, 500)
+LATENCY = 0.05
+SOURCES = ("TMDB", "TMDBlogo", "trakt", "plex")
+STAGES = ("fetch", "decode", "resize", "composite", "text", "encode", "sync")
+
+OVERVIEW = ("A retired agent is pulled back into the field when a routine courier job turns into a race across three "
+            "continents, forcing old rivals to work together before an unknown enemy can strike again.")
+
+
+def _fixture(size, mode, fmt) -> bytes:
+    """Returns an encoded test image with some detail, so decoding it costs about as much as real artwork."""
+    noise = Image.effect_noise(size, 40)
+    image = Image.merge("RGB", (noise, Image.linear_gradient("L").resize(size), noise.transpose(Image.FLIP_LEFT_RIGHT)))
+    if mode == "RGBA":
+        image = image.convert("RGBA")
+        image.putalpha(Image.linear_gradient("L").rotate(90).resize(size))
+    data = BytesIO()
+    image.save(data, fmt)
+    return data.getvalue()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Answers the TMDB, Trakt and Plex requests of the scripts with generated metadata and fixture images."""
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        half = (self.server.items + 1) // 2
+        headers = {}
+        if url.path.startswith("/t/p/") or url.path.startswith("/plex/photo/"):
+            body = self.server.logo if url.path.endswith(".png") else self.server.backdrop
+            content_type = "image/png" if url.path.endswith(".png") else "image/jpeg"
+        elif parts[0] == "plex":
+            content_type = "application/xml"
+            container = self._plex(parts[1:], query, half)
+            if container is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = ET.tostring(container, encoding="utf-8")
+        else:
+            content_type = "application/json"
+            if parts[:2] == ["3", "trending"]:
+                first = 1 if parts[2] == "movie" else 100001
+                data = {"results": [self._media(parts[2], first + i) for i in range(half)]}
+            elif parts[:2] == ["3", "genre"]:
+                data = {"genres": [{"id": 18, "name": "Drama"}, {"id": 28, "name": "Action"}]}
+            elif parts[0] == "3":
+                data = self._details(parts[1], int(parts[2]))
+            elif parts[0] == "trakt" and parts[3] == "lists":
+                data = {"updated_at": "2024-01-01T00:00:00.000Z"}
+            elif parts[0] == "trakt":
+                page, limit = int(query["page"][0]), int(query["limit"][0])
+                data = [self._trakt_item(i) for i in range((page - 1) * limit + 1, min(page * limit, self.server.items) + 1)]
+                headers["X-Pagination-Page-Count"] = str(-(-self.server.items // limit))
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _media(media_type, media_id):
+        media = {"id": media_id, "overview": OVERVIEW, "backdrop_path": f"/backdrop{media_id}.jpg",
+                 "genre_ids": [18, 28], "vote_average": 7.25}
+        if media_type == "movie":
+            media.update(title=f"Movie {media_id}", release_date="2024-05-01")
+        else:
+            media.update(name=f"Show {media_id}", first_air_date="2023-09-15")
+        return media
+
+    def _details(self, media_type, media_id):
+        details = self._media(media_type, media_id)
+        details.update(genres=[{"name": "Drama"}, {"name": "Action"}], runtime=128, number_of_seasons=3,
+                       images={"logos": [{"iso_639_1": "en", "file_path": f"/logo{media_id}.png", "aspect_ratio": 2.67}]})
+        return details
+
+    def _plex(self, parts, query, half):
+        """Returns the XML of the Plex server, its movie and show libraries and their newest items."""
+        if parts in ([], [""]):
+            return ET.Element("MediaContainer", friendlyName="benchmark", machineIdentifier="benchmark", version="1.40.0.0")
+        if parts == ["library"]:
+            return ET.Element("MediaContainer", title1="Plex Library")
+        if parts == ["library", "sections"]:
+            container = ET.Element("MediaContainer", size="2")
+            ET.SubElement(container, "Directory", key="1", type="movie", title="Movies")
+            ET.SubElement(container, "Directory", key="2", type="show", title="TV Shows")
+            return container
+        if len(parts) != 4 or parts[:2] != ["library", "sections"] or parts[2] not in ("1", "2"):
+            return None
+        section_type, tag, first = ("movie", "Video", 1) if parts[2] == "1" else ("show", "Directory", 100001)
+        if parts[3] == "collections" or query.get("includeMeta"):
+            # The sort fields plexapi checks a search against
+            container = ET.Element("MediaContainer", size="0")
+            if parts[3] == "all":
+                meta_type = ET.SubElement(ET.SubElement(container, "Meta"), "Type", type=section_type,
+                                          key=f"/library/sections/{parts[2]}/all", title=section_type)
+                for field in ("addedAt", "originallyAvailableAt"):
+                    ET.SubElement(meta_type, "Sort", key=field, descKey=f"{field}:desc", defaultDirection="desc", title=field)
+            return container
+        if parts[3] != "all":
+            return None
+        start = int(query.get("X-Plex-Container-Start", ["0"])[0])
+        size = int(query.get("X-Plex-Container-Size", [str(half)])[0])
+        indices = range(start, min(start + size, half))
+        container = ET.Element("MediaContainer", size=str(len(indices)), totalSize=str(half))
+        for index in indices:
+            rating_key = str(first + index)
+            item = ET.SubElement(container, tag, type=section_type, ratingKey=rating_key, key=f"/library/metadata/{rating_key}",
+                                 title=f"{section_type.title()} {rating_key}", summary=OVERVIEW, year="2024",
+                                 art=f"/library/metadata/{rating_key}/art/1714521600", audienceRating="7.3",
+                                 addedAt=str(1714521600 - index), originallyAvailableAt="2024-05-01",
+                                 duration="7680000", childCount="3")
+            ET.SubElement(item, "Genre", tag="Drama")
+            ET.SubElement(item, "Genre", tag="Action")
+        return container
+
+    @staticmethod
+    def _trakt_item(index):
+        media_type = "movie" if index % 2 else "show"
+        return {"type": media_type, media_type: {"title": f"Item {index}", "ids": {"tmdb": index}}}
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(items, latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    server.items = items
+    server.latency = latency
+    server.backdrop = _fixture((1920, 1080), "RGB", "JPEG")
+    server.logo = _fixture((800, 300), "RGBA", "PNG")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def use_work_dir(work_dir):
+    """Keeps the caches of this process in the temporary folder of a run, also called in each render worker."""
+    import gradients
+    import imagecache
+    imagecache.IMAGE_CACHE_DIR = os.path.join(work_dir, "images")
+    gradients.GRADIENT_CACHE_DIR = os.path.join(work_dir, "gradients")
+    # The font given with --font is read where it is, only other fonts would be downloaded here
+    fonts.FONT_CACHE_DIR = os.path.join(work_dir, "fonts")
+
+
+def run_source(source, items, latency, font, workers):
+    """Runs one script against the stand-in servers in this process and returns its measurements."""
+    import httpcache
+    import manifest
+    import renderpool
+    import ShieldShare
+    import tmdbapi
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        base = start_server(items, latency)
+        # Keep every cache and output of the run in the temporary folder, render workers are spawned with the
+        # default settings so the pool sets them up the same way
+        use_work_dir(work_dir)
+        httpcache.CACHE_PATH = os.path.join(work_dir, "http.sqlite")
+        manifest.MANIFEST_DIR = os.path.join(work_dir, "manifests")
+        ShieldShare.SYNC_MANIFEST_DIR = os.path.join(work_dir, "sync")
+        tmdbapi.API_URL = f"{base}/3/"
+        tmdbapi.IMAGE_URL = f"{base}/t/p/"
+        if workers is not None:
+            renderpool.RENDER_WORKERS = workers
+        output_dir = os.path.join(work_dir, source)
+
+        start = time.perf_counter()
+        renderpool.start_pool(initializer=use_work_dir, initargs=(work_dir,))
+        if source == "TMDB":
+            import TMDB
+            TMDB.API_URL, TMDB.TRUETYPE_URL, TMDB.BACKGROUND_DIR = f"{base}/3/", font, output_dir
+            TMDB.num_pages_movies = TMDB.num_pages_tvshows = 1
+            TMDB.main()
+        elif source == "TMDBlogo":
+            import TMDBlogo
+            TMDBlogo.url, TMDBlogo.truetype_url, TMDBlogo.background_dir = f"{base}/3/", font, output_dir
+            TMDBlogo.trending_movies_url = f"{base}/3/trending/movie/week?language=en-US"
+            TMDBlogo.trending_tvshows_url = f"{base}/3/trending/tv/week?language=en-US"
+            TMDBlogo.main()
+        elif source == "trakt":
+            import trakt
+            trakt.trakt_url, trakt.truetype_url, trakt.background_dir = f"{base}/trakt/", font, output_dir
+            trakt.username, trakt.list_name = "user", "list"
+            trakt.trakt_list_path = os.path.join(work_dir, "trakt_list.json")
+            trakt.main()
+        elif source == "plex":
+            import plex
+            plex.baseurl, plex.token, plex.truetype_url, plex.background_dir = f"{base}/plex", "benchmark", font, output_dir
+            # Half of the items are movies and half are shows, like on the TMDB stand-in
+            plex.limit = (items + 1) // 2
+            plex.main()
+        else:
+            raise ValueError(f"Unknown source {source}")
+        ShieldShare.sync_folders(output_dir, os.path.join(work_dir, "shield"))
+        seconds = time.perf_counter() - start
+        # The workers must have exited to count in the peak memory of the children
+        renderpool.stop_pool()
+
+        totals = metrics.snapshot()
+        images = len([entry for entry in os.scandir(output_dir) if entry.is_file() and not entry.name.endswith(".tmp")])
+        result = {"source": source, "items": items, "latency": latency, "seconds": round(seconds, 3), "images": images,
+                  "images_per_second": round(images / seconds, 2),
+                  "stages": {name: round(total[0], 3) for name, total in totals["stages"].items()},
+                  "counters": totals["counters"]}
+        try:
+            import resource
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+            result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+            result["worker_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+        except ImportError:
+            pass
+        return result
+    finally:
+        # About a gigabyte of artwork, caches and wallpapers per run, the workers must be gone before it is removed
+        renderpool.stop_pool()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_table(results):
+    columns = ["source", "items", "seconds", "img/s", "RSS MB"] + list(STAGES)
+    print(" ".join(f"{column:>9}" for column in columns))
+    for result in results:
+        row = [result["source"], result["items"], result["seconds"], result["images_per_second"],
+               result.get("peak_rss_mb", "n/a")] + [result["stages"].get(stage, 0.0) for stage in STAGES]
+        print(" ".join(f"{value:>9}" for value in row))
+    print("Stage times are summed over all items and render workers, so they can add up to more than the run time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the wallpaper scripts against local stand-in servers.")
+    parser.add_argument("--sources", nargs="+", default=SOURCES, choices=SOURCES)
+    parser.add_argument("--counts", nargs="+", type=int, default=ITEM_COUNTS)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    parser.add_argument("--workers", type=int, help="number of render workers, defaults to RENDER_WORKERS")
+    parser.add_argument("--font", help="local font file, defaults to the cached font of the scripts")
+    parser.add_argument("--json", help="also save the results to this file")
+    parser.add_argument("--run", nargs=2, metavar=("SOURCE", "ITEMS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    font = args.font or fonts.get_font_path()
+    if args.run:
+        print(json.dumps(run_source(args.run[0], int(args.run[1]), args.latency, font, args.workers)))
+        return
+
+    results = []
+    for source in args.sources:
+        for count in args.counts:
+            # Every run gets its own interpreter, so the peak memory and warm caches of one run don't leak into the next
+            command = [sys.executable, os.path.abspath(__file__), "--run", source, str(count),
+                       "--latency", str(args.latency), "--font", font]
+            if args.workers is not None:
+                command += ["--workers", str(args.workers)]
+            process = subprocess.run(command, capture_output=True, text=True)
+            if process.returncode != 0:
+                # The last line of the traceback, if the run got as far as writing one
+                error = process.stderr.strip().splitlines()
+                print(f"{source} with {count} items failed with exit code {process.returncode}" + (f":\n{error[-1]}" if error else ""))
+                continue
+            results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+            print(f"{source} with {count} items: {results[-1]['seconds']}s")
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+# Helpers shared by the clients of the different servers to send many requests at once without overloading them
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class RateLimiter:
+    """Spaces out requests so that all threads together stay under a requests-per-second budget."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the caller is allowed to send its next request."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        """Holds back every thread for the given number of seconds, e.g. after a 429."""
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+class ThreadPool(ThreadPoolExecutor):
+    """A thread pool running each task in a copy of the context that submitted it.
+
+    What a task records then counts towards the metrics run of the caller, not of no run at all.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def prefetch_iter(func: Callable[[T], R], items: Iterable[T], max_workers: int) -> Iterator[R]:
+    """Runs func over the items concurrently, pulling them lazily, and yields the results in order as they arrive.
+
+    At most twice max_workers calls are in flight, so the items of a long listing are never all held at once.
+    """
+    with ThreadPool(max_workers=max_workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
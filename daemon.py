@@ -0,0 +1,88 @@
+import importlib
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import encoder
+import metrics
+import renderpool
+
+# Edit to set how often each script refreshes its wallpapers, in seconds, and remove the ones you don't use
+SCHEDULE = {
+    "TMDB": 6 * 60 * 60,
+    # TMDBlogo draws the same trending items into the same folder as TMDB, schedule only one of the two
+    # "TMDBlogo": 6 * 60 * 60,
+    "trakt": 60 * 60,
+    "plex": 15 * 60,
+}
+
+# Each interval is randomly stretched or shortened by up to this fraction, so the sources don't wake up together
+JITTER = 0.1
+
+# Run with `python daemon.py` to refresh all scheduled scripts, or e.g. `python daemon.py plex trakt` for some of them.
+# The scripts are imported once: fonts, layouts, HTTP sessions, the Plex connection and the cache databases
+# stay loaded between refreshes, so a refresh only does the work that is actually new.
+
+stop = threading.Event()
+
+
+def run_source(name: str, module, interval: float):
+    """Refreshes one script on its interval. Its refreshes never overlap, a late one only delays the next."""
+    while not stop.is_set():
+        started = time.monotonic()
+        print(f"[{name}] Refreshing")
+        try:
+            # Refreshes of other scripts running at the same time also count towards the metrics of this one
+            with metrics.run(name):
+                module.main()
+        except Exception:
+            # A failed refresh, e.g. while the server is unreachable, is retried on the next one
+            traceback.print_exc()
+        elapsed = time.monotonic() - started
+        delay = max(0.0, interval * random.uniform(1 - JITTER, 1 + JITTER) - elapsed)
+        print(f"[{name}] Refreshed in {elapsed:.1f}s, next refresh in {delay / 60:.0f} min")
+        stop.wait(delay)
+
+
+def output_dir(module) -> str:
+    return os.path.abspath(getattr(module, "BACKGROUND_DIR", None) or module.background_dir)
+
+
+def main():
+    names = sys.argv[1:] or list(SCHEDULE)
+    unknown = [name for name in names if name not in SCHEDULE]
+    if unknown:
+        print(f"Unknown scripts: {', '.join(unknown)}, pick from {', '.join(SCHEDULE)}")
+        return
+
+    modules = {name: importlib.import_module(name) for name in names}
+    encoder.get_profile()
+    # Scripts sharing a folder would keep replacing and removing each other's wallpapers
+    owners = {}
+    for name in names:
+        other = owners.setdefault(output_dir(modules[name]), name)
+        if other != name:
+            print(f"{other} and {name} both save their wallpapers in {output_dir(modules[name])}, schedule only one of them")
+            return
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    renderpool.start_pool()
+    threads = [threading.Thread(target=run_source, args=(name, modules[name], SCHEDULE[name]), name=name, daemon=True)
+               for name in names]
+    for thread in threads:
+        thread.start()
+    # Wake up once a minute at most, the signal handlers can only run in this thread between waits on some systems
+    while not stop.wait(60):
+        pass
+    print("Stopping, waiting for running refreshes to finish")
+    for thread in threads:
+        thread.join()
+    renderpool.stop_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import time
+from io import BytesIO
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from PIL import Image
+
+import fileutil
+import metrics
+
+try:
+    # Pillow 10 needs the pillow-avif-plugin package to write AVIF, newer versions can do it on their own
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Edit to choose the format the wallpapers are saved in, one of the profiles below
+OUTPUT_PROFILE = "jpeg"
+
+# Encoder settings of each format, edit them to trade encode time against file size
+# Check that your launcher can show WebP or AVIF wallpapers before using them
+PROFILES = {
+    "jpeg": {
+        "format": "JPEG",
+        "extension": ".jpg",
+        "params": {"quality": 85, "subsampling": "4:2:0", "optimize": True, "progressive": True},
+    },
+    "webp": {
+        "format": "WEBP",
+        "extension": ".webp",
+        "params": {"quality": 85, "method": 4},
+    },
+    "avif": {
+        "format": "AVIF",
+        "extension": ".avif",
+        "params": {"quality": 70, "speed": 6},
+    },
+}
+
+# Edit to also save smaller copies of every wallpaper for lower resolution TVs, e.g. ((1920, 1080), (1280, 720)).
+# They are scaled down from the full 3840x2160 wallpaper, so use the same 16:9 shape, and saved in a subfolder of
+# the output folder named after their size, e.g. 1920x1080, which can be synced to its own TV
+OUTPUT_SIZES = ()
+
+
+class Encoded(NamedTuple):
+    """What saving one wallpaper cost."""
+    path: str
+    size: int
+    seconds: float
+
+
+def get_profile(name: Optional[str] = None) -> Dict:
+    """Returns the settings of an output profile, checking that Pillow can write its format."""
+    name = name or OUTPUT_PROFILE
+    profile = PROFILES[name]
+    # Plugins such as pillow-avif-plugin register their formats in Image.SAVE, features.check does not know them
+    Image.init()
+    if profile["format"] not in Image.SAVE:
+        raise RuntimeError(f"This Pillow installation can't write {profile['format']}, pick another OUTPUT_PROFILE")
+    return profile
+
+
+def extension(name: Optional[str] = None) -> str:
+    """Returns the file extension of the wallpapers, e.g. to name them."""
+    return PROFILES[name or OUTPUT_PROFILE]["extension"]
+
+
+def output_dirs(output_dir: str) -> List[str]:
+    """Returns the folders a wallpaper is saved in: the output folder, then the subfolder of each extra size."""
+    return [output_dir] + [os.path.join(output_dir, f"{width}x{height}") for width, height in OUTPUT_SIZES]
+
+
+def save(image: Image.Image, path: str, name: Optional[str] = None) -> Encoded:
+    """Encodes an image with an output profile and writes it atomically, so the launcher never reads half a file."""
+    profile = get_profile(name)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    start = time.perf_counter()
+    image.save(buffer, profile["format"], **profile["params"])
+    seconds = time.perf_counter() - start
+    size = buffer.tell()
+    fileutil.atomic_write(path, buffer.getbuffer())
+    metrics.add("encode", seconds)
+    metrics.count("images_saved", format=profile["format"])
+    metrics.count("images_saved_bytes", size, format=profile["format"])
+    return Encoded(path, size, seconds)
+
+
+def summary(results: Iterable[Optional[Encoded]]) -> str:
+    """Returns the total size and encode time of the saved wallpapers."""
+    encoded = [result for result in results if result]
+    if not encoded:
+        return "No wallpaper saved"
+    size = sum(result.size for result in encoded)
+    seconds = sum(result.seconds for result in encoded)
+    return (f"Saved {len(encoded)} wallpapers: {size / 1024 / 1024:.1f} MB, "
+            f"{size / 1024 / len(encoded):.0f} KB and {seconds * 1000 / len(encoded):.0f} ms of encoding on average")
@@ -0,0 +1,25 @@
+import os
+import threading
+from typing import Union
+
+
+def atomic_write(path: str, data: Union[bytes, str]):
+    """Replaces a file atomically, so a reader such as the launcher or another run never sees half of it.
+
+    The data goes to a hidden temporary file in the same folder first, named after the process and thread so
+    concurrent writers of the same file don't collide, and which is removed again if writing fails.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    directory, name = os.path.split(path)
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,57 @@
+import os
+import threading
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from PIL import ImageFont
+
+import fileutil
+import metrics
+
+# The default font used by every script
+TRUETYPE_URL = 'https://github.com/googlefonts/roboto/raw/main/src/hinted/Roboto-Light.ttf'
+
+# Fonts are downloaded once into this folder and reused on every later run, even offline
+FONT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "fonts")
+
+_font_paths: Dict[str, str] = {}
+_fonts: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+_lock = threading.Lock()
+
+
+def get_font_path(url: str = TRUETYPE_URL) -> str:
+    """Returns the local path of a font, downloading it into the cache on first use."""
+    path = _font_paths.get(url)
+    if path is not None:
+        return path
+    with _lock:
+        if url in _font_paths:
+            return _font_paths[url]
+        if os.path.isfile(url):
+            # A local font file can be used as is
+            path = url
+        else:
+            path = os.path.join(FONT_CACHE_DIR, os.path.basename(urlparse(url).path))
+            if not os.path.isfile(path):
+                os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+                with urlopen(url, timeout=30) as response:
+                    data = response.read()
+                metrics.count_request(url, response.status, len(data))
+                # An interrupted download never leaves a broken font
+                fileutil.atomic_write(path, data)
+        _font_paths[url] = path
+        return path
+
+
+def get_font(size: int, url: str = TRUETYPE_URL) -> ImageFont.FreeTypeFont:
+    """Returns a loaded font of the given size, shared for the life of the process."""
+    key = (get_font_path(url), size)
+    font = _fonts.get(key)
+    if font is None:
+        with _lock:
+            font = _fonts.get(key)
+            if font is None:
+                font = ImageFont.truetype(key[0], size=size)
+                _fonts[key] = font
+    return font
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import threading
+from io import BytesIO
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+import fileutil
+
+# Fades are generated from a few parameters instead of shipped as images, so any canvas size or style costs one
+# computation per size, after which the result is kept in memory and in this folder
+GRADIENT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "gradients")
+
+# Which edge each direction runs away from, as (axis, reversed)
+DIRECTIONS = {"right": (1, False), "left": (1, True), "down": (0, False), "up": (0, True)}
+
+_gradients: Dict[str, Image.Image] = {}
+_lock = threading.Lock()
+
+
+def _ramp(length: int, stops: Sequence[Sequence[float]]) -> np.ndarray:
+    """Returns the opacity along one axis, interpolated linearly between (position, opacity) stops from 0 to 1."""
+    positions = np.linspace(0.0, 1.0, length)
+    return np.interp(positions, [stop[0] for stop in stops], [stop[1] for stop in stops])
+
+
+def render(size: Tuple[int, int], color: Sequence[int], layers: Sequence[Dict]) -> Image.Image:
+    """Returns an RGBA image of a color whose alpha is made of linear gradients layered over each other.
+
+    Each layer has a direction (right, left, down or up), its stops and an optional overall opacity.
+    """
+    width, height = size
+    transparency = np.ones((height, width))
+    for layer in layers:
+        axis, reverse = DIRECTIONS[layer["direction"]]
+        ramp = _ramp(width if axis == 1 else height, layer["stops"]) * layer.get("opacity", 1.0)
+        if reverse:
+            ramp = ramp[::-1]
+        # Stacking layers works like pasting one semi-transparent fade over another
+        transparency *= 1.0 - (ramp[np.newaxis, :] if axis == 1 else ramp[:, np.newaxis])
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[..., :3] = color[:3]
+    pixels[..., 3] = np.rint((1.0 - transparency) * 255)
+    return Image.fromarray(pixels, "RGBA")
+
+
+def get(size: Tuple[int, int], color: Sequence[int], layers: Sequence[Dict]) -> Image.Image:
+    """Returns a gradient, generated once per size and parameters and then read from memory or the disk cache."""
+    key = json.dumps([list(size), list(color), layers], sort_keys=True)
+    image = _gradients.get(key)
+    if image is not None:
+        return image
+    path = os.path.join(GRADIENT_CACHE_DIR, f"{size[0]}x{size[1]}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.png")
+    try:
+        image = Image.open(path)
+        image.load()
+    except (OSError, ValueError):
+        image = render(size, color, layers)
+        os.makedirs(GRADIENT_CACHE_DIR, exist_ok=True)
+        buffer = BytesIO()
+        image.save(buffer, "PNG")
+        fileutil.atomic_write(path, buffer.getbuffer())
+    with _lock:
+        return _gradients.setdefault(key, image)
@@ -0,0 +1,142 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import metrics
+
+# Metadata responses are kept in this SQLite file between runs
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "http.sqlite")
+
+# Edit to change the maximum size of the cached response bodies, least recently used entries are evicted first
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Time to live in seconds per endpoint, the first matching pattern wins and unmatched URLs are not cached
+HOUR = 60 * 60
+TTLS = [
+    (re.compile(r"/genre/(movie|tv)/list"), 7 * 24 * HOUR),
+    (re.compile(r"/(movie|tv)/\d+/images"), 24 * HOUR),
+    (re.compile(r"/(movie|tv)/\d+(\?|$)"), 12 * HOUR),
+    (re.compile(r"/trending/|/discover/"), 1 * HOUR),
+    (re.compile(r"api\.trakt\.tv/"), 15 * 60),
+]
+
+Sender = Callable[[str, Dict], requests.Response]
+
+_connection: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+def get_ttl(url: str) -> int:
+    """Returns how long a response for the given URL stays fresh."""
+    for pattern, ttl in TTLS:
+        if pattern.search(url):
+            return ttl
+    return 0
+
+
+def _connect() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        _connection = sqlite3.connect(CACHE_PATH, timeout=30, check_same_thread=False, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB, "
+            "etag TEXT, last_modified TEXT, expires REAL, last_access REAL)"
+        )
+        _connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+    return _connection
+
+
+def _send(url: str, headers: Dict) -> requests.Response:
+    with metrics.stage("fetch"):
+        response = requests.get(url, headers=headers, timeout=10)
+    metrics.count_request(url, response.status_code, len(response.content))
+    return response
+
+
+def _to_response(url: str, status: int, headers: str, body: bytes) -> requests.Response:
+    """Rebuilds a requests response from a cache entry."""
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(json.loads(headers))
+    response._content = body
+    response.encoding = "utf-8"
+    return response
+
+
+def _store(url: str, response: requests.Response, ttl: int):
+    now = time.time()
+    connection = _connect()
+    connection.execute(
+        "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (url, response.status_code, json.dumps({"Content-Type": response.headers.get("Content-Type", "application/json")}),
+         response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"), now + ttl, now),
+    )
+    _evict(connection)
+
+
+def _evict(connection: sqlite3.Connection):
+    """Drops the least recently used responses once the cache grows past its budget."""
+    total = connection.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+    if total <= MAX_CACHE_BYTES:
+        return
+    target = MAX_CACHE_BYTES * 0.9
+    for url, size in connection.execute("SELECT url, LENGTH(body) FROM responses ORDER BY last_access").fetchall():
+        connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+        total -= size
+        if total <= target:
+            break
+
+
+def get(url: str, headers: Optional[Dict] = None, send: Sender = _send) -> requests.Response:
+    """Returns the response for a GET request, served from the cache while fresh and revalidated once stale."""
+    ttl = get_ttl(url)
+    if ttl <= 0:
+        metrics.count("http_cache", result="bypass")
+        return send(url, dict(headers or {}))
+
+    with _lock:
+        row = _connect().execute(
+            "SELECT status, headers, body, etag, last_modified, expires FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        if row and row[5] > time.time():
+            _connect().execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+            metrics.count("http_cache", result="hit")
+            return _to_response(url, row[0], row[1], row[2])
+
+    request_headers = dict(headers or {})
+    if row:
+        # Ask the server whether the stale entry is still valid
+        if row[3]:
+            request_headers["If-None-Match"] = row[3]
+        if row[4]:
+            request_headers["If-Modified-Since"] = row[4]
+    try:
+        response = send(url, request_headers)
+    except requests.RequestException:
+        if row:
+            # Serve the stale entry when the API can't be reached
+            metrics.count("http_cache", result="stale")
+            return _to_response(url, row[0], row[1], row[2])
+        raise
+
+    with _lock:
+        if row and response.status_code == 304:
+            now = time.time()
+            _connect().execute("UPDATE responses SET expires = ?, last_access = ? WHERE url = ?", (now + ttl, now, url))
+            metrics.count("http_cache", result="revalidated")
+            return _to_response(url, row[0], row[1], row[2])
+        if response.status_code == 200:
+            _store(url, response, ttl)
+    metrics.count("http_cache", result="miss")
+    return response
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+
+import requests
+
+import fileutil
+import metrics
+
+# Downloaded backdrops and logos are kept in this folder between runs
+IMAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "images")
+
+# Edit to change the disk space used by the image cache, least recently used images are evicted first
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+
+TIMEOUT = 10
+
+_total_bytes: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _path(key: str) -> str:
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, digest[:2], digest)
+
+
+def _entries():
+    """Yields (path, size, last access) for every cached image."""
+    if not os.path.isdir(IMAGE_CACHE_DIR):
+        return
+    for folder in os.scandir(IMAGE_CACHE_DIR):
+        if folder.is_dir():
+            for entry in os.scandir(folder.path):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+
+def _evict():
+    """Removes the least recently used images until the cache is back under its budget."""
+    global _total_bytes
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    _total_bytes = sum(size for _, size, _ in entries)
+    target = MAX_CACHE_BYTES * 0.9
+    for path, size, _ in entries:
+        if _total_bytes <= target:
+            break
+        try:
+            os.remove(path)
+            _total_bytes -= size
+        except OSError:
+            pass
+
+
+def has(key: str) -> bool:
+    """Tells whether an image is cached."""
+    return os.path.isfile(_path(key))
+
+
+def get(key: str) -> Optional[bytes]:
+    """Returns the cached bytes of an image, or None if it isn't cached."""
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        # The modification time tracks the last use for the LRU eviction
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+
+def put(key: str, data: bytes):
+    """Stores the bytes of an image, replacing the file atomically so concurrent runs never see half of it."""
+    global _total_bytes
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fileutil.atomic_write(path, data)
+    with _lock:
+        if _total_bytes is None:
+            _evict()
+        else:
+            _total_bytes += len(data)
+            if _total_bytes > MAX_CACHE_BYTES:
+                _evict()
+
+
+def fetch(url: str, key: Optional[str] = None, headers: Optional[Dict] = None,
+          session: Optional[requests.Session] = None) -> Optional[bytes]:
+    """Returns the bytes of an image, downloading it only when it isn't cached yet.
+
+    The key identifies the image independently of volatile URL parts such as tokens, it defaults to the URL.
+    """
+    key = key or url
+    data = get(key)
+    if data is not None:
+        metrics.count("image_cache", result="hit")
+        return data
+    metrics.count("image_cache", result="miss")
+    with metrics.stage("fetch"):
+        response = (session or requests).get(url, headers=headers, timeout=TIMEOUT)
+    if session is None:
+        # A session counts its own requests, see metrics.count_responses
+        metrics.count_request(url, response.status_code, len(response.content))
+    if response.status_code != 200:
+        print(f"Failed to download {url.split('?')[0]}: status code {response.status_code}")
+        return None
+    put(key, response.content)
+    return response.content
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+from typing import Dict, Set, Tuple
+
+import encoder
+import fileutil
+
+# Render manifests are kept here, outside the output folders so they are never synced to the TV
+MANIFEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "manifests")
+
+_file_digests: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_digest(path: str) -> str:
+    """Returns the SHA-1 of a file's content, hashed once per process and change."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_digests.get(key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        _file_digests[key] = digest
+    return digest
+
+
+def fingerprint(*parts) -> str:
+    """Returns a stable hash of everything that goes into a wallpaper."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RenderManifest:
+    """Remembers the fingerprint of every wallpaper in an output folder so unchanged ones are not rendered again."""
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        name = os.path.basename(os.path.abspath(output_dir))
+        suffix = hashlib.sha1(os.path.abspath(output_dir).encode("utf-8")).hexdigest()[:8]
+        self.path = os.path.join(MANIFEST_DIR, f"{name}-{suffix}.json")
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries: Dict[str, Dict] = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.claimed: Dict[str, str] = {}
+        self.kept: Set[str] = set()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def claim(self, filename: str, identity: str) -> str:
+        """Reserves a file name for an item for this run, telling apart items whose cleaned titles collide."""
+        owner = self.claimed.get(filename)
+        if owner is not None and owner != identity:
+            stem, extension = os.path.splitext(filename)
+            filename = f"{stem}_{''.join(c if c.isalnum() else '_' for c in identity)}{extension}"
+        self.claimed[filename] = identity
+        self.kept.add(filename)
+        return filename
+
+    def is_current(self, filename: str, item_fingerprint: str) -> bool:
+        """Tells whether the wallpaper on disk was rendered from exactly these inputs."""
+        entry = self.entries.get(filename)
+        return (entry is not None and entry.get("fingerprint") == item_fingerprint
+                and all(os.path.isfile(os.path.join(output_dir, filename)) for output_dir in encoder.output_dirs(self.output_dir)))
+
+    def record(self, filename: str, item_fingerprint: str):
+        """Stores the fingerprint of a freshly rendered wallpaper."""
+        self.kept.add(filename)
+        self.entries[filename] = {"fingerprint": item_fingerprint, "identity": self.claimed.get(filename)}
+
+    def keep_all(self):
+        """Keeps every wallpaper of the last run, e.g. for incremental updates that only touch some of them."""
+        for filename, entry in self.entries.items():
+            self.claimed[filename] = entry.get("identity")
+            self.kept.add(filename)
+
+    def find(self, identity: str):
+        """Returns the file name of an item's wallpaper, or None if it has none."""
+        for filename, entry in self.entries.items():
+            if entry.get("identity") == identity:
+                return filename
+        return None
+
+    def remove(self, filename: str):
+        """Deletes a wallpaper and forgets it."""
+        self.entries.pop(filename, None)
+        self.claimed.pop(filename, None)
+        self.kept.discard(filename)
+        for output_dir in encoder.output_dirs(self.output_dir):
+            file_path = os.path.join(output_dir, filename)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+                print(f"Removed unused file: {os.path.relpath(file_path, self.output_dir)}")
+
+    def finish(self, remove_orphans: bool = True):
+        """Removes wallpapers that were not part of this run and saves the manifest."""
+        if remove_orphans:
+            for output_dir in encoder.output_dirs(self.output_dir):
+                if not os.path.isdir(output_dir):
+                    continue
+                for file_name in os.listdir(output_dir):
+                    file_path = os.path.join(output_dir, file_name)
+                    if file_name not in self.kept and os.path.isfile(file_path):
+                        os.remove(file_path)
+                        print(f"Removed unused file: {os.path.relpath(file_path, self.output_dir)}")
+            self.entries = {name: entry for name, entry in self.entries.items() if name in self.kept}
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        fileutil.atomic_write(self.path, json.dumps(self.entries, indent=1, sort_keys=True))
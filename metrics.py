@@ -0,0 +1,187 @@
+import cProfile
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+import fileutil
+
+# Where the time and bandwidth of a run go: the time spent in each stage (fetch, decode, resize, composite, text,
+# encode, sync) summed over all items, and counters such as requests per endpoint, bytes and cache hits.
+# Numbers count towards the runs active in the context they are recorded in, so scripts running side by side in
+# the daemon keep their own. Render workers send their own numbers back with each result, see renderpool
+
+# A JSON summary of the last run of each script is written here
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "metrics")
+
+# Edit to the --collector.textfile.directory of your node_exporter to let Prometheus scrape the runs, None to disable
+PROMETHEUS_DIR = METRICS_DIR
+
+# Edit to True to save a cProfile of each run next to its summary, open it with `python -m pstats <file>`
+PROFILE = False
+
+# Edit to True to add the peak memory and the lines that allocated the most to each summary, it slows the run down
+TRACE_MEMORY = False
+
+# Everything this process recorded, and the collectors of the runs active in the current context
+_totals: Dict = {"stages": {}, "counters": {}}
+_collectors: contextvars.ContextVar[Tuple[Dict, ...]] = contextvars.ContextVar("collectors", default=())
+_lock = threading.Lock()
+
+
+def _targets() -> Tuple[Dict, ...]:
+    return (_totals,) + _collectors.get()
+
+
+def add(name: str, seconds: float, count: int = 1):
+    """Adds time spent in a stage."""
+    with _lock:
+        for totals in _targets():
+            total = totals["stages"].setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += count
+
+
+@contextmanager
+def stage(name: str):
+    """Times the code in the with block as part of a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+def count(name: str, value: float = 1, **labels):
+    """Adds to a counter, e.g. count("http_requests", endpoint="/3/movie/{id}")."""
+    key = name
+    if labels:
+        key += "{" + ",".join(f'{label}="{labels[label]}"' for label in sorted(labels)) + "}"
+    with _lock:
+        for totals in _targets():
+            totals["counters"][key] = totals["counters"].get(key, 0) + value
+
+
+def endpoint(url: str) -> str:
+    """Returns a URL without its query and ids, to count requests per endpoint."""
+    parsed = urlparse(url)
+    # The first segment is kept, it is the API version of TMDB
+    path = re.sub(r"(?<=.)/\d+(?=/|$)", "/{id}", parsed.path)
+    if parsed.netloc == "image.tmdb.org" or re.search(r"\.(jpe?g|png|svg|webp)$", path):
+        # Every image has its own path, count them per host
+        path = "/{image}"
+    return f"{parsed.netloc}{path}"
+
+
+def count_request(url: str, status: int, size: int):
+    """Counts an HTTP request and the bytes of its response by endpoint."""
+    count("http_requests", endpoint=endpoint(url), status=status)
+    count("http_bytes", size, endpoint=endpoint(url))
+
+
+def count_responses(session):
+    """Counts every request a requests session sends, including those made for it by a client such as plexapi."""
+    session.hooks["response"].append(
+        lambda response, *args, **kwargs: count_request(response.url, response.status_code, len(response.content)))
+
+
+def _copy(totals: Dict) -> Dict:
+    with _lock:
+        return {"stages": {name: list(total) for name, total in totals["stages"].items()},
+                "counters": dict(totals["counters"])}
+
+
+def snapshot() -> Dict:
+    """Returns the stage (seconds, count) and counter values this process recorded so far."""
+    return _copy(_totals)
+
+
+def merge(totals: Dict):
+    """Adds the numbers of another process, e.g. a render worker, to this process and the runs of the caller."""
+    with _lock:
+        for target in _targets():
+            for name, (seconds, stage_count) in totals["stages"].items():
+                total = target["stages"].setdefault(name, [0.0, 0])
+                total[0] += seconds
+                total[1] += stage_count
+            for key, value in totals["counters"].items():
+                target["counters"][key] = target["counters"].get(key, 0) + value
+
+
+@contextmanager
+def collect():
+    """Collects what is recorded in the with block and the threads it hands work to, see concurrency.ThreadPool.
+
+    Yields the collector, which holds the numbers as snapshot() returns them once the block ends.
+    """
+    collector: Dict = {"stages": {}, "counters": {}}
+    token = _collectors.set(_collectors.get() + (collector,))
+    try:
+        yield collector
+    finally:
+        _collectors.reset(token)
+
+
+def _write(path: str, text: str):
+    """Replaces a file atomically, the textfile collector must never read half of it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fileutil.atomic_write(path, text)
+
+
+def _prometheus(summary: Dict) -> str:
+    source = summary["source"]
+    lines = [
+        "# HELP wallpapers_run_seconds Duration of the last run.",
+        "# TYPE wallpapers_run_seconds gauge",
+        f'wallpapers_run_seconds{{source="{source}"}} {summary["seconds"]:.3f}',
+        "# HELP wallpapers_run_timestamp_seconds End of the last run.",
+        "# TYPE wallpapers_run_timestamp_seconds gauge",
+        f'wallpapers_run_timestamp_seconds{{source="{source}"}} {summary["finished"]:.0f}',
+        "# HELP wallpapers_stage_seconds Time spent in each stage during the last run, summed over all workers.",
+        "# TYPE wallpapers_stage_seconds gauge",
+    ]
+    for name, (seconds, _) in sorted(summary["stages"].items()):
+        lines.append(f'wallpapers_stage_seconds{{source="{source}",stage="{name}"}} {seconds:.3f}')
+    names = set()
+    for key, value in sorted(summary["counters"].items()):
+        name, _, labels = key.partition("{")
+        if name not in names:
+            names.add(name)
+            lines.append(f"# TYPE wallpapers_{name} gauge")
+        labels = f'source="{source}",{labels}' if labels else f'source="{source}"}}'
+        lines.append(f"wallpapers_{name}{{{labels} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def run(source: str):
+    """Measures a run of a script and writes its summary when it ends, even if it failed."""
+    start = time.perf_counter()
+    profiler = cProfile.Profile() if PROFILE else None
+    if profiler:
+        # Only the thread running the script is profiled, render workers are separate processes
+        profiler.enable()
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    with collect() as collector:
+        try:
+            yield
+        finally:
+            summary = dict(_copy(collector), source=source, seconds=time.perf_counter() - start, finished=time.time())
+            if profiler:
+                profiler.disable()
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                profiler.dump_stats(os.path.join(METRICS_DIR, f"{source}.prof"))
+            if TRACE_MEMORY:
+                summary["memory_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                summary["memory_top"] = [str(stat) for stat in tracemalloc.take_snapshot().statistics("lineno")[:10]]
+                tracemalloc.reset_peak()
+            _write(os.path.join(METRICS_DIR, f"{source}.json"), json.dumps(summary, indent=1, sort_keys=True))
+            if PROMETHEUS_DIR:
+                _write(os.path.join(PROMETHEUS_DIR, f"wallpapers_{source}.prom"), _prometheus(summary))
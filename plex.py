@@ -1,19 +1,30 @@
-import requests
-import os
-import time
-from PIL import Image, ImageDraw, ImageFont
-from io import BytesIO
-from urllib.request import urlopen
+import itertools
 import unicodedata
 import re
-import shutil
-import textwrap
+import heapq
+from datetime import datetime
+import concurrency
+import encoder
+import renderer
+import imagecache
+import manifest
+import metrics
+import requests
+from requests.adapters import HTTPAdapter
 
 
 truetype_url = 'https://github.com/googlefonts/roboto/raw/main/src/hinted/Roboto-Light.ttf'
 
 from plexapi.server import PlexServer
 
+# Set your Plex server url and token here
+baseurl = 'http://XXXX:32400'
+token = 'XXXX'
+
+# Maximum number of simultaneous requests and requests per second sent to the Plex server
+max_concurrent_requests = 4
+requests_per_second = 10
+
 # Set the order_by parameter to 'aired' or 'added'
 order_by = 'added'
 download_movies = True
@@ -21,190 +32,167 @@ download_series = True
 # Set the number of latest movies to download
 limit = 10
 
+# Plex fields used to sort the items for each order_by value
+sort_fields = {'added': 'addedAt', 'aired': 'originallyAvailableAt'}
+
 # Create a directory to save the backgrounds
 background_dir = "plex_backgrounds"
-# Clear the contents of the folder
-if os.path.exists(background_dir):
-    shutil.rmtree(background_dir)
-    os.makedirs(background_dir)
-
-def resize_image(image, height):
-    ratio = height / image.height
-    width = int(image.width * ratio)
-    return image.resize((width, height))
-
-def truncate_summary(summary, max_chars):
-    if len(summary) > max_chars:
-        return summary[:max_chars]
-    else:
-        return summary
+
+# The layout in the layouts folder describing the wallpaper
+layout = "plex"
+
+# Size of the backdrop on the wallpaper, the Plex photo transcoder sends the artwork already at this size
+backdrop_width = 2667
+backdrop_height = 1500
 
 def clean_filename(filename):
     # Remove problematic characters from the filename
     cleaned_filename = re.sub(r'[\\/*?:"<>|]', '_', filename)
     return cleaned_filename
 
-def download_latest_media(order_by, limit, media_type):
-    baseurl = 'http://XXXX:32400'
-    token = 'XXXX'
-    plex = PlexServer(baseurl, token)
-
-    os.makedirs(background_dir, exist_ok=True)
-
+# One pooled connection to the Plex server is shared by the whole run
+plex_session = requests.Session()
+plex_session.mount("http://", HTTPAdapter(pool_maxsize=max_concurrent_requests))
+plex_session.mount("https://", HTTPAdapter(pool_maxsize=max_concurrent_requests))
+metrics.count_responses(plex_session)
+plex_limiter = concurrency.RateLimiter(requests_per_second)
+plex_server = None
+
+def get_server():
+    global plex_server
+    if plex_server is None:
+        plex_server = PlexServer(baseurl, token, session=plex_session)
+    return plex_server
+
+# Download an item's artwork into the image cache, keeping within the Plex request limits
+def fetch_artwork(job):
+    record = job[0]
+    if not imagecache.has(record["backdrop_key"]):
+        plex_limiter.wait()
+        imagecache.fetch(record["backdrop_url"], key=record["backdrop_key"], session=plex_session)
+    return job
+
+def latest_items(plex, order_by, limit, media_type):
     if media_type == 'movie' and download_movies:
-        media_items = plex.library.search(libtype='movie')
+        section_type = 'movie'
     elif media_type == 'tv' and download_series:
-        media_items = plex.library.search(libtype='show')
+        section_type = 'show'
     else:
         print("Invalid media_type parameter.")
-        return
-    
-    if order_by == 'aired':
-        media_sorted = sorted(media_items, key=lambda x: x.originallyAvailableAt, reverse=True)
-    elif order_by == 'added':
-        media_sorted = sorted(media_items, key=lambda x: x.addedAt, reverse=True)
-    else:
+        return []
+
+    if order_by not in sort_fields:
         print("Invalid order_by parameter. Please use 'aired' or 'added'.")
-        return
-
-    for item in media_sorted[:limit]:
-        # Get the URL of the background image
-        background_url = item.artUrl
-
-        if background_url:
-            try:
-                # Download the background image with a timeout of 10 seconds
-                response = requests.get(background_url, timeout=10)
-                if response.status_code == 200:
-                    # Remove problematic characters from the item title
-                    filename_safe_title = unicodedata.normalize('NFKD', item.title).encode('ASCII', 'ignore').decode('utf-8')
-                    filename_safe_title = clean_filename(filename_safe_title)
-                    # Save the background image to a file
-                    background_filename = os.path.join(background_dir, f"{filename_safe_title}.jpg")
-                    with open(background_filename, 'wb') as f:
-                        f.write(response.content)
-                    
-                    # Open the background image with PIL
-                    image = Image.open(background_filename)
-                    bckg = Image.open(os.path.join(os.path.dirname(__file__),"bckg.png"))
-                    
-                    # Resize the image to have a height of 1080 pixels
-                    image = resize_image(image, 1500)
-
-                    # Open overlay image
-                    overlay = Image.open(os.path.join(os.path.dirname(__file__),"overlay.png"))
-                    plexlogo = Image.open(os.path.join(os.path.dirname(__file__),"plexlogo.png"))
-
-                    bckg.paste(image, (1175, 0))
-                    bckg.paste(overlay, (1175,0), overlay)
-                    bckg.paste(plexlogo, (680, 970),plexlogo)
-
-                    # Add text on top of the image with shadow effect
-                    draw = ImageDraw.Draw(bckg)
-                    
-                    #Text Font
-                    font_title = ImageFont.truetype(urlopen(truetype_url), size=190)
-                    font_info = ImageFont.truetype(urlopen(truetype_url), size=55)
-                    font_summary = ImageFont.truetype(urlopen(truetype_url), size=45)
-                    font_metadata = ImageFont.truetype(urlopen(truetype_url), size=50)
-                    font_custom = ImageFont.truetype(urlopen(truetype_url), size=60)                 
-                    
-                    title_text = f"{item.title}"
-                    if media_type == 'movie':
-                        if item.audienceRating:
-                            rating_text = f" IMDb: {item.audienceRating}"
-                        elif item.rating:
-                            rating_text = f" IMDb: {item.rating}"
-                        else:
-                            rating_text = ""
-                        duration_hours = item.duration // (60*60*1000)
-                        duration_minutes = (item.duration // (60*1000)) % 60
-                        duration_text = f"{duration_hours}h{duration_minutes}min"
-                        info_text = f"{item.year}  •  {', '.join([genre.tag for genre in item.genres])}  •  {duration_text}  •  {rating_text}"
-                    else:
-                        if item.audienceRating:
-                            rating_text = f" IMDb: {item.audienceRating}"
-                        elif item.rating:
-                            rating_text = f" IMDb: {item.rating}"
-                        else:
-                            rating_text = ""
-                        seasons_count = len(item.seasons())
-                        if seasons_count == 1:
-                            seasons_text = "Season"
-                        else:
-                            seasons_text = "Seasons"
-                        info_text = f"{item.year}  •  {', '.join([genre.tag for genre in item.genres])}  •  {seasons_count} {seasons_text}  •  {rating_text}"
-                    summary_text = truncate_summary(item.summary, 175)
-                    custom_text = "Now Available on"
-                    
-                    title_text_width, title_text_height = draw.textlength(title_text, font=font_title), draw.textlength(title_text, font=font_title)
-                    info_text_width, info_text_height = draw.textlength(info_text, font=font_info), draw.textlength(info_text, font=font_info)
-                    custom_text_width, custom_text_height = draw.textlength(custom_text, font=font_info), draw.textlength(custom_text, font=font_custom)
-                    summary_text_width, summary_text_height = draw.textlength(summary_text, font=font_summary), draw.textlength(summary_text, font=font_summary)
-                    metadata_text_width, metadata_text_height = draw.textlength(info_text, font=font_metadata), draw.textlength(info_text, font=font_metadata)
-                    
-                    #Position
-                    title_position = (200, 540)
-                    summary_position = (210, 830)
-                    info_position = (210, 520)
-                    metadata_position = (210, 920)
-                    custom_position = (210, 950)
-                    shadow_offset = 2
-
-                    #Color
-                    shadow_color = "black"
-                    main_color = "white"
-                    info_color = "white"
-                    summary_color = (150,150,150)  # Grey color for the summary
-                    metadata_color = "white"
-
-                    # Draw shadow for title
-                    draw.text((title_position[0] + shadow_offset, title_position[1] + shadow_offset), title_text, font=font_title, fill=shadow_color)
-                    # Draw main title text
-                    draw.text(title_position, title_text, font=font_title, fill=main_color)
-
-                    # Wrap summary text
-                    wrapped_summary = "\n".join(textwrap.wrap(summary_text, width=95)) + "..."
-                    
-                    # Draw shadow for info
-                    draw.text((info_position[0] + shadow_offset, info_position[1] + shadow_offset), info_text, font=font_summary, fill=shadow_color)
-                    # Draw main info text
-                    draw.text(info_position, info_text, font=font_summary, fill=summary_color)
-                    
-                    # Draw shadow for summary text
-                    draw.text((summary_position[0] + shadow_offset, summary_position[1] + shadow_offset), wrapped_summary, font=font_summary, fill=shadow_color)
-                    # Draw summary text
-                    draw.text(summary_position, wrapped_summary, font=font_summary, fill=summary_color)
-
-
-                    # Draw shadow for custom text
-                    draw.text((custom_position[0] + shadow_offset, custom_position[1] + shadow_offset), custom_text, font=font_custom, fill=shadow_color)                  
-                    # Draw custom text
-                    draw.text(custom_position, custom_text, font=font_custom, fill=metadata_color)
-
-
-
-                    
-                    # Save the modified image
-                    bckg = bckg.convert('RGB')  # Convert image to RGB mode to save as JPEG
-                    bckg.save(background_filename)
-                    print(f"Image saved: {background_filename}")
-
-                    
-                else:
-                    print(f"Failed to download background for {item.title}")
-            except Exception as e:
-                print(f"An error occurred while processing {item.title}: {e}")
+        return []
+    sort_field = sort_fields[order_by]
+
+    # Let the server sort each library and send only its newest items, so the cost doesn't grow with the library
+    media_items = []
+    for section in plex.library.sections():
+        if section.type == section_type:
+            media_items += section.search(sort=f"{sort_field}:desc", maxresults=limit)
+    # Merge the newest items of all libraries, items without a date go last
+    return heapq.nlargest(limit, media_items, key=lambda x: getattr(x, sort_field) or datetime.min)
+
+# Build the wallpaper job of an item, or None when its wallpaper is already up to date
+def make_job(plex, item, media_type, render_manifest):
+    if not item.art:
+        print(f"No background image found for {item.title}")
+        return None
+    # Let the server scale the artwork down so it covers the backdrop, instead of downloading the original
+    background_url = plex.transcodeImage(item.art, height=backdrop_height, width=backdrop_width, minSize=True, upscale=False)
+    try:
+        title_text = f"{item.title}"
+        if media_type == 'movie':
+            if item.audienceRating:
+                rating_text = f" IMDb: {item.audienceRating}"
+            elif item.rating:
+                rating_text = f" IMDb: {item.rating}"
+            else:
+                rating_text = ""
+            duration_hours = item.duration // (60*60*1000)
+            duration_minutes = (item.duration // (60*1000)) % 60
+            duration_text = f"{duration_hours}h{duration_minutes}min"
+            info_text = f"{item.year}  •  {', '.join([genre.tag for genre in item.genres])}  •  {duration_text}  •  {rating_text}"
         else:
-            print(f"No background image found for {item.title}")
-
-        # Adding a small delay to give the server some time to respond
-        time.sleep(1)
-
-# Download the latest movies according to the specified order and limit
-if download_movies:
-    download_latest_media(order_by, limit, 'movie')
-
-# Download the latest TV series according to the specified order and limit
-if download_series:
-    download_latest_media(order_by, limit, 'tv')
+            if item.audienceRating:
+                rating_text = f" IMDb: {item.audienceRating}"
+            elif item.rating:
+                rating_text = f" IMDb: {item.rating}"
+            else:
+                rating_text = ""
+            # The listing already holds the number of seasons, no need for a request per show
+            seasons_count = item.childCount if item.childCount is not None else len(item.seasons())
+            if seasons_count == 1:
+                seasons_text = "Season"
+            else:
+                seasons_text = "Seasons"
+            info_text = f"{item.year}  •  {', '.join([genre.tag for genre in item.genres])}  •  {seasons_count} {seasons_text}  •  {rating_text}"
+        # The art key changes whenever the artwork does, unlike the URL it holds no token
+        record = {
+            "backdrop_url": background_url,
+            "backdrop_key": f"plex:{item.art}@{backdrop_width}x{backdrop_height}",
+            "title": title_text,
+            "info": info_text,
+            "overview": item.summary,
+        }
+
+        # Remove problematic characters from the item title
+        filename_safe_title = unicodedata.normalize('NFKD', item.title).encode('ASCII', 'ignore').decode('utf-8')
+        filename_safe_title = clean_filename(filename_safe_title)
+        filename = render_manifest.claim(f"{filename_safe_title}{encoder.extension()}", f"plex-{item.ratingKey}")
+
+        # Render only when the metadata, artwork, layout or this script changed since the last run
+        item_fingerprint = manifest.fingerprint(record, renderer.fingerprint(layout, font_url=truetype_url), manifest.file_digest(__file__))
+        if render_manifest.is_current(filename, item_fingerprint):
+            return None
+        return (record, filename, item_fingerprint)
+    except Exception as e:
+        print(f"An error occurred while processing {item.title}: {e}")
+    return None
+
+# Yield the jobs of the latest items whose wallpaper changed, the listing is only fetched once the renderers ask for it
+def download_latest_media(order_by, limit, media_type, render_manifest):
+    plex = get_server()
+    for item in latest_items(plex, order_by, limit, media_type):
+        job = make_job(plex, item, media_type, render_manifest)
+        if job:
+            yield job
+
+# Download the artwork and render the wallpapers of the jobs, then record the saved ones in the manifest
+def render_jobs(jobs, render_manifest):
+    # Download the artwork concurrently within the request limits, a few items ahead of the renderers,
+    # which then read it from the image cache
+    downloaded = concurrency.prefetch_iter(fetch_artwork, jobs, max_workers=max_concurrent_requests)
+
+    # Render the changed wallpapers as their artwork arrives
+    # A single item, e.g. from a webhook, isn't worth starting render processes for
+    return renderer.render_jobs(layout, downloaded, render_manifest, font_url=truetype_url,
+                                workers=1 if isinstance(jobs, list) and len(jobs) <= 1 else None)
+
+
+def main():
+    # Fail before any wallpaper is claimed or removed if Pillow can't write the output format
+    encoder.get_profile()
+    # Wallpapers whose inputs did not change since the last run are kept as they are
+    render_manifest = manifest.RenderManifest(background_dir)
+    listings = []
+
+    # Download the latest movies according to the specified order and limit
+    if download_movies:
+        listings.append(download_latest_media(order_by, limit, 'movie', render_manifest))
+
+    # Download the latest TV series according to the specified order and limit
+    if download_series:
+        listings.append(download_latest_media(order_by, limit, 'tv', render_manifest))
+
+    results = render_jobs(itertools.chain.from_iterable(listings), render_manifest)
+    print(encoder.summary(results))
+
+    # Remove wallpapers that are no longer among the latest items
+    render_manifest.finish()
+
+
+if __name__ == "__main__":
+    with metrics.run("plex"):
+        main()
@@ -0,0 +1,220 @@
+import json
+import os
+import queue
+import sys
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import requests
+from plexapi.exceptions import NotFound
+
+import encoder
+import fileutil
+import manifest
+import metrics
+import plex
+import renderer
+import renderpool
+
+# Keeps the Plex wallpapers up to date from Plex webhooks instead of listing the libraries on a timer.
+# Add http://<this machine>:32500/ under Settings > Webhooks on your Plex server, then run `python plexwebhook.py`.
+# Plex itself sends library.new, the update and delete events can be relayed by other tools or replayed with
+# `python plexwebhook.py replay events.jsonl`, a file of webhook payloads with one JSON object per line.
+
+# Edit to change the address the listener accepts webhooks on
+LISTEN_HOST = "0.0.0.0"
+LISTEN_PORT = 32500
+
+UPDATE_EVENTS = ("library.new", "library.update")
+DELETE_EVENTS = ("library.delete",)
+
+# Plex item types and the wallpaper type they belong to, a new episode or season updates its show
+MEDIA_TYPES = {"movie": "movie", "show": "tv", "season": "tv", "episode": "tv"}
+
+# The newest items of each type are remembered here between runs, so the listener starts without a library scan
+WINDOW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "plex_window.json")
+
+events: "queue.Queue[Dict]" = queue.Queue()
+
+
+def _sort_value(item) -> float:
+    value = getattr(item, plex.sort_fields[plex.order_by])
+    # Items without a date sort last, like in plex.latest_items
+    return value.timestamp() if value else float("-inf")
+
+
+def _enabled(media_type: str) -> bool:
+    return plex.download_movies if media_type == "movie" else plex.download_series
+
+
+class Listener:
+    """Applies webhook events to the newest-items windows and their wallpapers, one event at a time."""
+
+    def __init__(self):
+        self.render_manifest = manifest.RenderManifest(plex.background_dir)
+        self.render_manifest.keep_all()
+        try:
+            with open(WINDOW_PATH, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        self.windows: Dict[str, Dict[str, float]] = {"movie": {}, "tv": {}}
+        if state.get("order_by") == plex.order_by and state.get("limit") == plex.limit:
+            self.windows.update(state.get("windows", {}))
+        else:
+            # No window yet or the settings changed, list the newest items once
+            for media_type in self.windows:
+                if _enabled(media_type):
+                    self.reload(media_type)
+            self.save()
+
+    def save(self):
+        self.render_manifest.finish(remove_orphans=False)
+        os.makedirs(os.path.dirname(WINDOW_PATH), exist_ok=True)
+        fileutil.atomic_write(WINDOW_PATH, json.dumps({"order_by": plex.order_by, "limit": plex.limit, "windows": self.windows}))
+
+    def _drop(self, media_type: str, rating_key: str):
+        self.windows[media_type].pop(rating_key, None)
+        filename = self.render_manifest.find(f"plex-{rating_key}")
+        if filename:
+            self.render_manifest.remove(filename)
+
+    def _render(self, server, item, media_type: str):
+        job = plex.make_job(server, item, media_type, self.render_manifest)
+        if job:
+            plex.render_jobs([job], self.render_manifest)
+
+    def reload(self, media_type: str):
+        """Rebuilds a window from the server's newest items, e.g. after one of them was deleted."""
+        server = plex.get_server()
+        items = plex.latest_items(server, plex.order_by, plex.limit, media_type)
+        window = {str(item.ratingKey): _sort_value(item) for item in items}
+        for rating_key in list(self.windows[media_type]):
+            if rating_key not in window:
+                self._drop(media_type, rating_key)
+        self.windows[media_type] = window
+        jobs = [job for job in (plex.make_job(server, item, media_type, self.render_manifest) for item in items) if job]
+        if jobs:
+            print(encoder.summary(plex.render_jobs(jobs, self.render_manifest)))
+
+    def update(self, media_type: str, rating_key: str):
+        """Renders a new or changed item if it belongs among the newest ones, pushing the oldest one out."""
+        server = plex.get_server()
+        try:
+            item = server.fetchItem(int(rating_key))
+        except NotFound:
+            self.delete(media_type, rating_key)
+            return
+        window = self.windows[media_type]
+        sort_value = _sort_value(item)
+        if rating_key not in window and len(window) >= plex.limit and sort_value <= min(window.values()):
+            return
+        window[rating_key] = sort_value
+        if len(window) > plex.limit:
+            self._drop(media_type, min(window, key=window.get))
+        if rating_key in window:
+            self._render(server, item, media_type)
+
+    def delete(self, media_type: str, rating_key: str):
+        """Removes the wallpaper of a deleted item and lets the next newest item take its place."""
+        if rating_key in self.windows[media_type]:
+            self._drop(media_type, rating_key)
+            self.reload(media_type)
+
+    def handle(self, payload: Dict):
+        event = payload.get("event")
+        metadata = payload.get("Metadata") or {}
+        media_type = MEDIA_TYPES.get(metadata.get("type"))
+        if event not in UPDATE_EVENTS + DELETE_EVENTS or not media_type or not _enabled(media_type):
+            return
+        # Episodes and seasons change the wallpaper of their show
+        if metadata["type"] == "episode":
+            rating_key = metadata.get("grandparentRatingKey")
+        elif metadata["type"] == "season":
+            rating_key = metadata.get("parentRatingKey")
+        else:
+            rating_key = metadata.get("ratingKey")
+        if not rating_key:
+            return
+        print(f"{event}: {metadata.get('title')}")
+        if event in DELETE_EVENTS and metadata["type"] in ("movie", "show"):
+            self.delete(media_type, str(rating_key))
+        else:
+            self.update(media_type, str(rating_key))
+        self.save()
+
+
+def parse_payload(content_type: str, body: bytes) -> Optional[Dict]:
+    """Returns the JSON payload of a webhook, sent by Plex as the payload field of a multipart form."""
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "payload":
+                return json.loads(part.get_payload(decode=True))
+    return None
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            payload = parse_payload(self.headers.get("Content-Type", ""), body)
+        except ValueError:
+            payload = None
+        # Answer right away, the events are applied in order by a single worker
+        self.send_response(200 if payload is not None else 400)
+        self.end_headers()
+        if payload is not None:
+            events.put(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def process_events(listener: Listener):
+    while True:
+        payload = events.get()
+        try:
+            with metrics.run("plexwebhook"):
+                listener.handle(payload)
+        except Exception as e:
+            print(f"An error occurred while processing the {payload.get('event')} event: {e}")
+
+
+def replay(path: str, url: str = f"http://127.0.0.1:{LISTEN_PORT}/"):
+    """Posts the webhook payloads of a file the way Plex does, e.g. to test the listener."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                response = requests.post(url, files={"payload": (None, line.strip(), "application/json")}, timeout=10)
+                print(f"{json.loads(line).get('event')}: {response.status_code}")
+
+
+def main():
+    if sys.argv[1:2] == ["replay"]:
+        replay(*sys.argv[2:4])
+        return
+    # Fail before any wallpaper is claimed or removed if Pillow can't write the output format
+    encoder.get_profile()
+    # Reloads render in processes started once for the life of the listener, with the layout already loaded,
+    # single items render in this process
+    renderpool.start_pool(initializer=renderer.preload, initargs=(plex.layout, None, plex.truetype_url))
+    try:
+        listener = Listener()
+        threading.Thread(target=process_events, args=(listener,), daemon=True).start()
+        server = ThreadingHTTPServer((LISTEN_HOST, LISTEN_PORT), WebhookHandler)
+        print(f"Listening for Plex webhooks on port {LISTEN_PORT}")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        renderpool.stop_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+from io import BytesIO
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+import encoder
+import fonts
+import imagecache
+import manifest
+import renderpool
+import templates
+import textlayout
+import metrics
+
+# Each source describes its wallpaper in a layout file in this folder: the static "template" branding,
+# where the "backdrop" goes and the text and image "elements" drawn from the fields of an item's record
+LAYOUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts")
+
+# Edit to trade resize quality against speed, e.g. LANCZOS is sharper and slower. With a reducing_gap, an image
+# at least twice as large as needed is first shrunk by a whole factor, which is much cheaper than filtering it at
+# full size and looks the same from a gap of 2, None turns it off
+RESAMPLE = Image.Resampling.BICUBIC
+REDUCING_GAP = 2.0
+
+_layouts: Dict[str, Dict] = {}
+_plans: Dict[Tuple[str, Optional[str], str], "DrawPlan"] = {}
+_lock = threading.Lock()
+
+
+def _tuples(value):
+    """Turns the JSON lists of a layout into the tuples Pillow expects for positions and colors."""
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _tuples(item) for key, item in value.items()}
+    return value
+
+
+def layout_path(name: str) -> str:
+    return os.path.join(LAYOUTS_DIR, f"{name}.json")
+
+
+def load_layout(name: str) -> Dict:
+    """Returns a layout as read from its file, loaded once per process."""
+    layout = _layouts.get(name)
+    if layout is None:
+        with open(layout_path(name), encoding="utf-8") as f:
+            layout = _tuples(json.load(f))
+        _layouts[name] = layout
+    return layout
+
+
+def image_box(name: str, field: str) -> Tuple[int, int]:
+    """Returns the box an image element of a layout is fitted into, e.g. to pick the size to download."""
+    for element in load_layout(name)["elements"]:
+        if element["type"] == "image" and element["field"] == field:
+            return element["box"]
+    raise KeyError(f"No image element for {field} in layout {name}")
+
+
+def scaled_size(size: Tuple[int, int], height: int) -> Tuple[int, int]:
+    """Returns the size of an image scaled to a height while maintaining aspect ratio."""
+    return int(size[0] * height / size[1]), height
+
+
+def fitted_size(size: Tuple[int, int], width: int, height: int) -> Tuple[int, int]:
+    """Returns the size of an image fitted within a box while maintaining aspect ratio."""
+    aspect_ratio = size[0] / size[1]
+    new_width = width
+    new_height = int(new_width / aspect_ratio)
+    # If the image is too tall for the box, fit its height instead
+    if new_height > height:
+        new_height = height
+        new_width = int(new_height * aspect_ratio)
+    return new_width, new_height
+
+
+def open_image(data: bytes, size_for: Callable[[Tuple[int, int]], Tuple[int, int]]) -> Image.Image:
+    """Decodes an image that will be resized to size_for(its size).
+
+    A JPEG is decoded at the smallest 1/2, 1/4 or 1/8 scale still covering that size, which takes a fraction
+    of the time and memory of a full decode.
+    """
+    image = Image.open(BytesIO(data))
+    if image.format == "JPEG":
+        image.draft(image.mode, size_for(image.size))
+    image.load()
+    return image
+
+
+def resize_image(image: Image.Image, height: int) -> Image.Image:
+    """Resizes an image to a specified height while maintaining aspect ratio."""
+    if image.height == height:
+        return image
+    return image.resize(scaled_size(image.size, height), RESAMPLE, reducing_gap=REDUCING_GAP)
+
+
+def resize_logo(image: Image.Image, width: int, height: int) -> Image.Image:
+    """Resizes an image to fit within a box while maintaining aspect ratio."""
+    size = fitted_size(image.size, width, height)
+    if image.size == size:
+        return image
+    return image.resize(size, RESAMPLE, reducing_gap=REDUCING_GAP)
+
+
+class DrawPlan:
+    """A layout compiled for one caption and font: fonts resolved, coordinates precomputed, base canvas built."""
+
+    def __init__(self, name: str, caption: Optional[str], font_url: str):
+        layout = load_layout(name)
+        self.template = layout["template"]
+        self.caption = caption
+        self.font_url = font_url
+        self.backdrop_height = layout["backdrop"]["height"]
+        self.backdrop_position = layout["backdrop"].get("position", (0, 0))
+        self.backdrop_align = layout["backdrop"].get("align", "left")
+        shadow = layout.get("shadow", {})
+        self.shadow_color = shadow.get("color", templates.SHADOW_COLOR)
+        shadow_offset = shadow.get("offset", templates.SHADOW_OFFSET)
+
+        self.elements: List[Dict] = []
+        for element in layout["elements"]:
+            step = dict(element)
+            x, y = element["position"]
+            if element["type"] == "text":
+                step["font"] = fonts.get_font(element["size"], font_url)
+                step["shadow_position"] = (x + shadow_offset, y + shadow_offset) if element.get("shadow", True) else None
+            self.elements.append(step)
+        templates.preload(self.template, caption, font_url)
+
+    def _text(self, step: Dict, value) -> Tuple[str, ImageFont.FreeTypeFont]:
+        """Lays out a text element within its max_width, shrinking or wrapping it as the layout asks."""
+        text = str(value)
+        font = step["font"]
+        max_width = step.get("max_width")
+        if not max_width:
+            return text, font
+        if step.get("min_size"):
+            font = textlayout.fit_font(text, step["size"], max_width, step["min_size"], self.font_url)
+        wrap = step.get("wrap")
+        if wrap:
+            lines = textlayout.wrap(text, font, max_width, wrap.get("max_lines"), wrap.get("placeholder", " ..."))
+            return "\n".join(lines), font
+        return textlayout.truncate(text, font, max_width, step.get("placeholder", " ...")), font
+
+    def _image(self, step: Dict, url: str, title: str) -> Optional[Image.Image]:
+        data = imagecache.fetch(url)
+        if not data:
+            return None
+        try:
+            with metrics.stage("decode"):
+                image = open_image(data, lambda size: fitted_size(size, *step["box"]))
+                # Palette and grayscale logos are converted before resizing, a palette can't be filtered
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA")
+            with metrics.stage("resize"):
+                return resize_logo(image, *step["box"])
+        except Exception as e:
+            print(f"Failed to draw {step['field']} for {title}: {e}")
+            return None
+
+    def draw(self, record: Dict) -> Optional[Image.Image]:
+        """Returns the wallpaper of an item, or None when its backdrop can't be downloaded."""
+        title = record.get("title", "")
+        data = imagecache.fetch(record["backdrop_url"], key=record.get("backdrop_key"))
+        if not data:
+            print(f"Failed to download background for {title}")
+            return None
+        with metrics.stage("decode"):
+            backdrop = open_image(data, lambda size: scaled_size(size, self.backdrop_height))
+        with metrics.stage("resize"):
+            backdrop = resize_image(backdrop, self.backdrop_height)
+        with metrics.stage("composite"):
+            canvas = templates.get_canvas(self.template, self.caption, self.font_url)
+            x, y = self.backdrop_position
+            if self.backdrop_align == "right":
+                x = canvas.width - backdrop.width
+            templates.paste_backdrop(canvas, backdrop, (x, y), self.template, self.caption, self.font_url)
+
+        draw = ImageDraw.Draw(canvas)
+        drawn = set()
+        for step in self.elements:
+            if step.get("unless") in drawn:
+                continue
+            value = record.get(step["field"])
+            if not value:
+                continue
+            if step["type"] == "image":
+                image = self._image(step, value, title)
+                if image is None:
+                    continue
+                x, y = step["position"]
+                if step.get("anchor") == "bottom":
+                    y -= image.height
+                with metrics.stage("composite"):
+                    # Only logos with transparency need a mask, e.g. not a JPEG one
+                    canvas.paste(image, (x, y), image if image.mode == "RGBA" else None)
+            else:
+                with metrics.stage("text"):
+                    text, font = self._text(step, value)
+                    # Text is drawn from its top left corner, lower a shrunk font by the ascent it lost so it keeps
+                    # the baseline of the full size one instead of moving up towards the line above
+                    shift = step["font"].getmetrics()[0] - font.getmetrics()[0]
+                    if step["shadow_position"]:
+                        x, y = step["shadow_position"]
+                        draw.text((x, y + shift), text, font=font, fill=self.shadow_color)
+                    x, y = step["position"]
+                    draw.text((x, y + shift), text, font=font, fill=step["color"])
+            drawn.add(step["field"])
+        return canvas
+
+
+def get_plan(name: str, caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL) -> DrawPlan:
+    """Returns the draw plan of a layout, compiled once per process."""
+    key = (name, caption, font_url)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = DrawPlan(name, caption, font_url)
+        with _lock:
+            plan = _plans.setdefault(key, plan)
+    return plan
+
+
+def preload(name: str, caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL):
+    """Compiles a layout, e.g. once in each render process."""
+    get_plan(name, caption, font_url)
+
+
+def fingerprint(name: str, caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL) -> str:
+    """Returns a hash of the layout, template, renderer and encoder settings a source's wallpapers are built from."""
+    template = load_layout(name)["template"]
+    return manifest.fingerprint(manifest.file_digest(layout_path(name)), templates.fingerprint(template, caption, font_url),
+                                manifest.file_digest(__file__), manifest.file_digest(textlayout.__file__),
+                                encoder.OUTPUT_PROFILE, encoder.PROFILES[encoder.OUTPUT_PROFILE], encoder.OUTPUT_SIZES)
+
+
+def render(name: str, record: Dict, path: str, caption: Optional[str] = None,
+           font_url: str = fonts.TRUETYPE_URL) -> Optional[encoder.Encoded]:
+    """Renders the wallpaper of an item with a layout and saves it in every output size.
+
+    Returns the encode stats of the full size wallpaper, or None if it wasn't saved.
+
+    The record holds the item's backdrop_url, an optional backdrop_key for the image cache,
+    and the fields the layout's elements draw, e.g. title, info, overview and logo.
+    """
+    try:
+        canvas = get_plan(name, caption, font_url).draw(record)
+        if canvas is None:
+            return None
+        encoded = encoder.save(canvas, path)
+        # Smaller sizes are scaled down from the full size wallpaper, the artwork and text are only drawn once.
+        # A reducing_gap of 1 turns whole factors such as 4K to 1080p or 720p into a cheap box average
+        for size, output_dir in zip(encoder.OUTPUT_SIZES, encoder.output_dirs(os.path.dirname(path))[1:]):
+            os.makedirs(output_dir, exist_ok=True)
+            with metrics.stage("resize"):
+                scaled = canvas.resize(size, RESAMPLE, reducing_gap=1.0)
+            encoder.save(scaled, os.path.join(output_dir, os.path.basename(path)))
+        print(f"Image saved: {path} ({encoded.size / 1024:.0f} KB, encoded in {encoded.seconds * 1000:.0f} ms)")
+        return encoded
+    except Exception as e:
+        print(f"An error occurred while processing {record.get('title')}: {e}")
+    return None
+
+
+def render_jobs(name: str, jobs: Iterable[Tuple[Dict, str, str]], render_manifest: manifest.RenderManifest,
+                caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL,
+                workers: Optional[int] = None) -> List[Optional[encoder.Encoded]]:
+    """Renders the (record, filename, fingerprint) jobs of a source into its output folder as they are produced,
+    in parallel when several render workers are configured, and records the saved wallpapers in the manifest.
+
+    If producing the jobs fails, e.g. a listing can't be fetched, the wallpapers rendered so far are recorded
+    without removing the others and the error is raised again.
+    """
+    results = []
+    try:
+        for (filename, item_fingerprint), saved in renderpool.render_stream(
+                render,
+                (((filename, item_fingerprint), ((name, record, os.path.join(render_manifest.output_dir, filename), caption, font_url), {}))
+                 for record, filename, item_fingerprint in jobs),
+                initializer=preload, initargs=(name, caption, font_url), workers=workers):
+            if saved:
+                render_manifest.record(filename, item_fingerprint)
+            results.append(saved)
+    except Exception:
+        render_manifest.finish(remove_orphans=False)
+        raise
+    return results
@@ -0,0 +1,147 @@
+import contextvars
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import metrics
+
+# Edit to set the number of processes rendering wallpapers in parallel, 1 renders everything in the main process
+RENDER_WORKERS = os.cpu_count() or 1
+
+# Edit to set how many jobs are prepared ahead of the renderers and how many wait for each render worker,
+# memory grows with this instead of with the number of items
+QUEUE_DEPTH = 4
+
+Job = Tuple[Sequence, Dict[str, Any]]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_done = object()
+
+
+def _new_pool(workers: int, initializer: Optional[Callable] = None, initargs: Tuple = ()) -> ProcessPoolExecutor:
+    # Workers are started with spawn: a forked worker could inherit a lock held by another thread, e.g. one
+    # fetching the next page, and hang on it forever
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
+
+
+def start_pool(workers: Optional[int] = None, initializer: Optional[Callable] = None, initargs: Tuple = ()):
+    """Keeps one process pool for all later render_stream calls, e.g. in daemon mode.
+
+    Its workers live as long as the pool, so the fonts and layouts they load stay warm between refreshes.
+    Spawned workers start from a fresh interpreter, the initializer can set them up, e.g. with the settings
+    a caller changed at runtime.
+    """
+    global _pool
+    workers = RENDER_WORKERS if workers is None else workers
+    if _pool is None and workers > 1:
+        _pool = _new_pool(workers, initializer, initargs)
+
+
+def stop_pool():
+    """Shuts down the pool started by start_pool."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _call(func: Callable, args: Sequence, kwargs: Dict[str, Any]):
+    """Runs a job in a worker and sends the metrics it recorded back with the result."""
+    with metrics.collect() as totals:
+        result = func(*args, **kwargs)
+    return result, totals
+
+
+def _results(futures) -> List[Any]:
+    results = []
+    for future in futures:
+        result, totals = future.result()
+        metrics.merge(totals)
+        results.append(result)
+    return results
+
+
+def _put(buffer: queue.Queue, entry, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            buffer.put(entry, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(items: Iterable, buffer: queue.Queue, stop: threading.Event):
+    try:
+        for item in items:
+            if not _put(buffer, (item, None), stop):
+                return
+        _put(buffer, (_done, None), stop)
+    except BaseException as e:
+        _put(buffer, (_done, e), stop)
+
+
+def prepared(items: Iterable, depth: int = QUEUE_DEPTH) -> Iterator:
+    """Pulls items from a generator in a background thread, at most depth items ahead of the caller.
+
+    The next page of a listing then downloads while the caller is busy with the current one.
+    Errors of the generator are raised in the caller.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    # The generator runs in the caller's context, so its requests count towards the caller's metrics run
+    threading.Thread(target=contextvars.copy_context().run, args=(_produce, items, buffer, stop), daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def render_stream(func: Callable, jobs: Iterable[Tuple[Any, Job]], initializer: Optional[Callable] = None,
+                  initargs: Tuple = (), workers: Optional[int] = None) -> Iterator[Tuple[Any, Any]]:
+    """Calls func(*args, **kwargs) for every (key, job) jobs yields and yields the (key, result) pairs in job order.
+
+    The jobs are pulled from their generator while earlier ones render and at most QUEUE_DEPTH jobs per worker
+    wait for a render worker, so fetching overlaps rendering and memory stays bounded. With more than one worker
+    the jobs run in a process pool, each worker process calls the initializer once so fonts and template assets
+    are loaded once per process, not once per item. func and the initializer must be module level functions
+    so they can be sent to the workers.
+    """
+    pool = _pool if workers is None else None
+    workers = RENDER_WORKERS if workers is None else workers
+    owned = None
+    if pool is None and workers > 1:
+        # No worker process is started until the first job arrives
+        owned = pool = _new_pool(workers, initializer, initargs)
+    try:
+        if pool is None:
+            initialized = False
+            for key, (args, kwargs) in prepared(jobs):
+                if initializer and not initialized:
+                    initializer(*initargs)
+                    initialized = True
+                yield key, func(*args, **kwargs)
+            return
+        pending = deque()
+        for key, (args, kwargs) in prepared(jobs):
+            pending.append((key, pool.submit(_call, func, args, kwargs)))
+            while len(pending) >= QUEUE_DEPTH * workers:
+                done_key, future = pending.popleft()
+                yield done_key, _results([future])[0]
+        while pending:
+            done_key, future = pending.popleft()
+            yield done_key, _results([future])[0]
+    finally:
+        if owned is not None:
+            owned.shutdown(cancel_futures=True)
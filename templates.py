@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+import fonts
+import gradients
+import manifest
+
+ASSETS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A template is the static branding of a source, the "template" section of its layout file:
+# the logo and the caption next to it never move, so they are composited once per run
+# into a base canvas that every item starts from
+
+SHADOW_COLOR = "black"
+CAPTION_COLOR = "white"
+SHADOW_OFFSET = 2
+
+# The size of the canvas every wallpaper is drawn on and its background color, "background" in a template overrides it
+CANVAS_SIZE = (3840, 2160)
+BACKGROUND_COLOR = (5, 18, 38)
+
+# The fade over the backdrop into the background, "overlay" in a template overrides it. It darkens the backdrop
+# from its left edge to the right and from the bottom up, each direction with its (position, opacity) stops
+OVERLAY = {
+    "size": (2667, 1500),
+    "color": BACKGROUND_COLOR,
+    "layers": [
+        {"direction": "right",
+         "stops": [(0, 1.0), (0.125, 0.839), (0.25, 0.655), (0.375, 0.486), (0.5, 0.349), (0.625, 0.239),
+                   (0.75, 0.145), (0.875, 0.067), (1, 0.0)]},
+        {"direction": "up",
+         "stops": [(0, 1.0), (0.125, 0.782), (0.25, 0.592), (0.375, 0.443), (0.5, 0.324), (0.625, 0.225),
+                   (0.75, 0.14), (0.875, 0.066), (1, 0.0)]},
+    ],
+}
+
+_assets: Dict[str, Image.Image] = {}
+_canvases: Dict[Tuple[str, str, str], Tuple[Image.Image, Optional[Tuple[Image.Image, Tuple[int, int]]]]] = {}
+_lock = threading.Lock()
+
+
+def load_asset(name: str) -> Image.Image:
+    """Returns a decoded image from the repository folder, decoded once per run."""
+    image = _assets.get(name)
+    if image is None:
+        with _lock:
+            image = _assets.get(name)
+            if image is None:
+                image = Image.open(os.path.join(ASSETS_DIR, name))
+                image.load()
+                _assets[name] = image
+    return image
+
+
+def _render_caption(caption: str, size: int, font_url: str) -> Image.Image:
+    """Renders a caption with its shadow on a transparent layer."""
+    font = fonts.get_font(size, font_url)
+    left, top, right, bottom = font.getbbox(caption)
+    layer = Image.new("RGBA", (right + SHADOW_OFFSET, bottom + SHADOW_OFFSET), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    draw.text((SHADOW_OFFSET, SHADOW_OFFSET), caption, font=font, fill=SHADOW_COLOR)
+    draw.text((0, 0), caption, font=font, fill=CAPTION_COLOR)
+    return layer
+
+
+def _build_canvas(template: Dict, caption: str, font_url: str):
+    # The background is fully opaque and every output is saved as RGB
+    canvas = Image.new("RGB", CANVAS_SIZE, tuple(template.get("background", BACKGROUND_COLOR)))
+    draw = ImageDraw.Draw(canvas)
+    position = tuple(template["caption_position"])
+    late_caption = None
+    if caption:
+        font = fonts.get_font(template["caption_size"], font_url)
+        if position[0] + draw.textlength(caption, font=font) + SHADOW_OFFSET < template["overlay_position"][0]:
+            draw.text((position[0] + SHADOW_OFFSET, position[1] + SHADOW_OFFSET), caption, font=font, fill=SHADOW_COLOR)
+            draw.text(position, caption, font=font, fill=CAPTION_COLOR)
+        else:
+            # A caption reaching into the backdrop must stay on top of it, so it is pasted after the backdrop
+            late_caption = (_render_caption(caption, template["caption_size"], font_url), position)
+    logo = load_asset(template["logo"])
+    canvas.paste(logo, tuple(template["logo_position"]), logo)
+    return canvas, late_caption
+
+
+def _get_template(template: Dict, caption: Optional[str], font_url: str):
+    if caption is None:
+        caption = template["caption"]
+    key = (json.dumps(template, sort_keys=True), caption, font_url)
+    entry = _canvases.get(key)
+    if entry is None:
+        entry = _build_canvas(template, caption, font_url)
+        with _lock:
+            entry = _canvases.setdefault(key, entry)
+    return entry
+
+
+def get_canvas(template: Dict, caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL) -> Image.Image:
+    """Returns a fresh copy of the precomposited base canvas of a template."""
+    return _get_template(template, caption, font_url)[0].copy()
+
+
+def paste_backdrop(canvas: Image.Image, image: Image.Image, position: Tuple[int, int], template: Dict,
+                   caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL):
+    """Pastes a backdrop onto a base canvas and blends the overlay over it."""
+    canvas.paste(image, position)
+    overlay = get_overlay(template)
+    canvas.paste(overlay, tuple(template["overlay_position"]), overlay)
+    late_caption = _get_template(template, caption, font_url)[1]
+    if late_caption:
+        layer, layer_position = late_caption
+        canvas.paste(layer, layer_position, layer)
+
+
+def get_overlay(template: Dict) -> Image.Image:
+    """Returns the fade pasted over the backdrop, generated once per size and style."""
+    overlay = template.get("overlay", OVERLAY)
+    return gradients.get(tuple(overlay["size"]), overlay["color"], overlay["layers"])
+
+
+def fingerprint(template: Dict, caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL) -> str:
+    """Returns a hash of the assets, font and settings a template's canvas is built from."""
+    return manifest.fingerprint(template, caption or template["caption"], CANVAS_SIZE, BACKGROUND_COLOR, OVERLAY,
+                                manifest.file_digest(os.path.join(ASSETS_DIR, template["logo"])),
+                                manifest.file_digest(fonts.get_font_path(font_url)), manifest.file_digest(__file__),
+                                manifest.file_digest(gradients.__file__))
+
+
+def preload(template: Dict, caption: Optional[str] = None, font_url: str = fonts.TRUETYPE_URL):
+    """Loads the base canvas and the overlay of a template, e.g. once in each render process."""
+    _get_template(template, caption, font_url)
+    get_overlay(template)
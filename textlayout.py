@@ -0,0 +1,98 @@
+from typing import Dict, List, Optional, Tuple
+
+from PIL import ImageFont
+
+import fonts
+
+# Wraps and truncates text to a width in pixels. Glyph advance widths are measured once per font and size,
+# after that measuring a line is a sum of table lookups instead of a FreeType call
+
+_advances: Dict[Tuple[str, int], Dict[str, float]] = {}
+
+
+def _table(font: ImageFont.FreeTypeFont) -> Dict[str, float]:
+    key = (font.path, font.size)
+    table = _advances.get(key)
+    if table is None:
+        table = _advances.setdefault(key, {})
+    return table
+
+
+def measure(text: str, font: ImageFont.FreeTypeFont) -> float:
+    """Returns the width of a line of text in pixels."""
+    table = _table(font)
+    width = 0.0
+    for char in text:
+        advance = table.get(char)
+        if advance is None:
+            advance = table[char] = font.getlength(char)
+        width += advance
+    return width
+
+
+def truncate(text: str, font: ImageFont.FreeTypeFont, max_width: float, placeholder: str = " ...") -> str:
+    """Shortens a line to fit max_width, dropping whole words first and ending with the placeholder."""
+    if measure(text, font) <= max_width:
+        return text
+    available = max_width - measure(placeholder, font)
+    words = text.split()
+    while len(words) > 1:
+        words.pop()
+        line = " ".join(words)
+        if measure(line, font) <= available:
+            return line + placeholder
+    # A single word too wide for the line is cut between characters
+    line = words[0] if words else ""
+    while line and measure(line, font) > available:
+        line = line[:-1]
+    return line + placeholder.lstrip()
+
+
+def wrap(text: str, font: ImageFont.FreeTypeFont, max_width: float, max_lines: Optional[int] = None,
+         placeholder: str = " ...") -> List[str]:
+    """Wraps text into lines no wider than max_width, the last allowed line ends with the placeholder if text is left over."""
+    space = measure(" ", font)
+    lines: List[str] = []
+    line: List[str] = []
+    line_width = 0.0
+    for word in text.split():
+        width = measure(word, font)
+        if line and line_width + space + width <= max_width:
+            line.append(word)
+            line_width += space + width
+            continue
+        if line:
+            lines.append(" ".join(line))
+            line = []
+        # Break words wider than a whole line between characters
+        while width > max_width and len(word) > 1:
+            cut = len(word) - 1
+            while cut > 1 and measure(word[:cut], font) > max_width:
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+            width = measure(word, font)
+        if max_lines and len(lines) >= max_lines:
+            # Stop measuring once the remaining words can't be shown anyway
+            return lines[:max_lines - 1] + [truncate(f"{lines[max_lines - 1]} {word}", font, max_width, placeholder)]
+        line = [word]
+        line_width = width
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+def fit_font(text: str, size: int, max_width: float, min_size: int,
+             font_url: str = fonts.TRUETYPE_URL) -> ImageFont.FreeTypeFont:
+    """Returns the largest font between min_size and size in which a line of text fits max_width."""
+    font = fonts.get_font(size, font_url)
+    width = measure(text, font)
+    if width <= max_width or size <= min_size:
+        return font
+    # Text width grows about linearly with the font size, so start from the proportional guess
+    size = max(min_size, min(size - 1, int(size * max_width / width)))
+    font = fonts.get_font(size, font_url)
+    while size > min_size and measure(text, font) > max_width:
+        size -= 1
+        font = fonts.get_font(size, font_url)
+    return font
@@ -0,0 +1,115 @@
+import math
+from typing import Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import concurrency
+import httpcache
+import metrics
+
+# TMDB allows around 50 requests per second and 20 connections per IP, stay a bit below both
+RATE_LIMIT = 40  # requests per second
+MAX_WORKERS = 16
+MAX_RETRIES = 5
+TIMEOUT = 10
+
+API_URL = "https://api.themoviedb.org/3/"
+
+# Image renditions served by TMDB, see https://developer.themoviedb.org/reference/configuration-details
+IMAGE_URL = "https://image.tmdb.org/t/p/"
+BACKDROP_WIDTHS = (300, 780, 1280)
+LOGO_WIDTHS = (45, 92, 154, 185, 300, 500)
+BACKDROP_ASPECT_RATIO = 16 / 9
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+limiter = concurrency.RateLimiter(RATE_LIMIT)
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+metrics.count_responses(session)
+
+
+def _retry_after(response: requests.Response, attempt: int) -> float:
+    """Returns how long to wait before retrying a throttled request."""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return float(2 ** attempt)
+
+
+def get(url: str, headers: Optional[Dict] = None, **kwargs) -> requests.Response:
+    """Sends a cached, rate-limited GET request."""
+    return httpcache.get(url, headers, lambda url, headers: _send(url, headers, **kwargs))
+
+
+def _send(url: str, headers: Dict, **kwargs) -> requests.Response:
+    """Sends a rate-limited GET request, retrying when the server answers 429 Too Many Requests."""
+    kwargs.setdefault("timeout", TIMEOUT)
+    for attempt in range(MAX_RETRIES):
+        limiter.wait()
+        with metrics.stage("fetch"):
+            response = session.get(url, headers=headers, **kwargs)
+        if response.status_code != 429:
+            return response
+        delay = _retry_after(response, attempt)
+        print(f"Rate limited by {url.split('?')[0]}, retrying in {delay:.1f}s")
+        limiter.pause(delay)
+    return response
+
+
+def prefetch_iter(func: Callable[[T], R], items: Iterable[T], max_workers: int = MAX_WORKERS) -> Iterator[R]:
+    """Runs func over the items concurrently within the TMDB connection limit, see concurrency.prefetch_iter."""
+    return concurrency.prefetch_iter(func, items, max_workers)
+
+
+def image_url(file_path: str, width: int, widths: Iterable[int]) -> str:
+    """Returns the URL of the smallest TMDB rendition at least width pixels wide, or the original."""
+    for size in widths:
+        if size >= width:
+            return f"{IMAGE_URL}w{size}{file_path}"
+    return f"{IMAGE_URL}original{file_path}"
+
+
+def backdrop_url(file_path: str, height: int) -> str:
+    """Returns the URL of the smallest backdrop rendition that can be resized to the given height."""
+    return image_url(file_path, math.ceil(height * BACKDROP_ASPECT_RATIO), BACKDROP_WIDTHS)
+
+
+def logo_url(file_path: str, box_width: int, box_height: int, aspect_ratio: Optional[float] = None) -> str:
+    """Returns the URL of the smallest logo rendition that still fills the given box."""
+    width = box_width
+    if aspect_ratio:
+        width = min(box_width, math.ceil(box_height * aspect_ratio))
+    return image_url(file_path, width, LOGO_WIDTHS)
+
+
+def fetch_details(media_type: str, media_id: int, headers: Dict, append_to_response: Iterable[str] = (),
+                  include_image_language: Iterable[str] = (), language: str = "en-US") -> Dict:
+    """Returns the details of a movie or TV show, with sub-resources such as images in the same request.
+
+    Returns an empty dict when TMDB doesn't answer with the details, e.g. for a removed item.
+    """
+    url = f"{API_URL}{media_type}/{media_id}?language={language}"
+    if append_to_response:
+        url += f"&append_to_response={','.join(append_to_response)}"
+    if include_image_language:
+        url += f"&include_image_language={','.join(include_image_language)}"
+    response = get(url, headers=headers)
+    if response.status_code != 200:
+        print(f"Failed to fetch {media_type} {media_id}: status code {response.status_code}")
+        return {}
+    return response.json()
+
+
+def select_logo(details: Dict, language: str = "en", png_only: bool = False) -> Optional[Dict]:
+    """Returns the first logo in a language from details fetched with the images sub-resource, or None."""
+    for logo in details.get("images", {}).get("logos", []):
+        if logo.get("iso_639_1") == language and (not png_only or logo["file_path"].endswith(".png")):
+            return logo
+    return None
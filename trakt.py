@@ -1,10 +1,12 @@
-import requests
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, UnidentifiedImageError
-from io import BytesIO
+import json
 import os
-import shutil
-from urllib.request import urlopen
-import textwrap
+import encoder
+import renderer
+import tmdbapi
+import fileutil
+import httpcache
+import manifest
+import metrics
 
 
 # Replace with your actual Trakt API key, TMDB API Read Access Token, username, and list name
@@ -18,12 +20,12 @@ tmdb_headers = {
     "Authorization": "Bearer XXXXX"
 }
 
-# Base URL for the API
-url = "https://api.themoviedb.org/3/"
-
 # Font URL
 truetype_url = 'https://github.com/googlefonts/roboto/raw/main/src/hinted/Roboto-Light.ttf'
 
+# The layout in the layouts folder describing the wallpaper
+layout = "trakt"
+
 # Function to truncate the overview text if it exceeds a certain length
 def truncate_overview(overview, max_chars):
     if len(overview) > max_chars:
@@ -36,194 +38,146 @@ def clean_filename(filename):
     cleaned_filename = "".join(c if c.isalnum() or c in "._-" else "_" for c in filename)
     return cleaned_filename
 
-# Function to fetch movies and shows from Trakt API
-def get_trakt_movies_and_shows(api_key, username, list_name):
-    url = f"https://api.trakt.tv/users/{username}/{list_name}/items"
+# Base URL of the Trakt API
+trakt_url = "https://api.trakt.tv/"
+
+# Number of list items requested per page from the Trakt API
+trakt_page_size = 100
+
+# The last fetched list is kept here with its updated_at, so an unchanged list isn't downloaded again
+trakt_list_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "trakt_list.json")
+
+# Trakt item types and the TMDB media type they are fetched as
+trakt_media_types = {"movie": "movie", "show": "tv"}
+
+# Function to fetch when the list last changed, or None if Trakt doesn't tell, e.g. for the watchlist
+def get_trakt_list_updated_at(headers, username, list_name):
+    response = httpcache.get(f"{trakt_url}users/{username}/lists/{list_name}", headers)
+    if response.status_code == 200:
+        return response.json().get("updated_at")
+    return None
+
+# Function to fetch the movies and shows of a Trakt list as (media type, TMDB id, title) items, page by page
+def get_trakt_items(api_key, username, list_name):
     traktheaders = {
         "Content-Type": "application/json",
         "trakt-api-version": "2",
         "trakt-api-key": api_key
     }
+    list_key = f"{username}/{list_name}"
+
+    # Reuse the items of the last run when the list didn't change since
+    updated_at = get_trakt_list_updated_at(traktheaders, username, list_name)
+    try:
+        with open(trakt_list_path, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = {}
+    if updated_at and saved.get("list") == list_key and saved.get("updated_at") == updated_at:
+        return [tuple(item) for item in saved["items"]]
+
+    items = {}
+    page, page_count = 1, 1
+    while page <= page_count:
+        response = httpcache.get(f"{trakt_url}users/{username}/{list_name}/items?page={page}&limit={trakt_page_size}", traktheaders)
+        if response.status_code != 200:
+            print(f"Error: Unable to fetch list (status code {response.status_code})")
+            return None
+        for item in response.json():
+            media_type = trakt_media_types.get(item['type'])
+            if media_type:
+                media = item[item['type']]
+                tmdb_id = media['ids'].get('tmdb')
+                # Items are told apart by type and TMDB id, a movie and a show may share a title
+                if tmdb_id:
+                    items.setdefault((media_type, tmdb_id), (media_type, tmdb_id, media['title']))
+        page_count = int(response.headers.get("X-Pagination-Page-Count", page))
+        page += 1
+
+    items = list(items.values())
+    if updated_at:
+        os.makedirs(os.path.dirname(trakt_list_path), exist_ok=True)
+        fileutil.atomic_write(trakt_list_path, json.dumps({"list": list_key, "updated_at": updated_at, "items": items}))
+    return items
+
+# Function to get the details of a movie or TV show from TMDB, together with its English logos in a single request
+def get_details(media_type, media_id):
+    return tmdbapi.fetch_details(media_type, media_id, tmdb_headers, append_to_response=("images",), include_image_language=("en",))
+
+# Create a directory to save the backgrounds, wallpapers whose inputs did not change are kept as they are
+background_dir = "trakt_backgrounds"
 
-    response = requests.get(url, headers=traktheaders)
-    if response.status_code == 200:
-        items = response.json()
-        movies = [(item['movie']['title'], item['movie']['ids']['tmdb']) for item in items if item['type'] == 'movie']
-        shows = [(item['show']['title'], item['show']['ids']['tmdb']) for item in items if item['type'] == 'show']
-        return movies, shows
+# Function to build the record of fields the layout draws for a movie or show
+def make_record(image_url, title, media_type, show_data, logo):
+    genres = ", ".join([genre['name'] for genre in show_data.get('genres', [])])
+    tmdb_score = round(show_data.get('vote_average', 0), 1)
+    if media_type == "movie":
+        year = show_data.get('release_date', '')[:4]
+        hours, minutes = divmod(show_data.get('runtime', 0), 60)
+        info = f"{genres}  •  {year}  •  {hours}h{minutes}min  •  TMDB: {tmdb_score}"
     else:
-        print(f"Error: Unable to fetch list (status code {response.status_code})")
-        return [], []
-
-# Function to fetch the logo for a movie or TV show from TMDB
-def get_logo(media_type, media_id, language="en"):
-    logo_url = f"{url}{media_type}/{media_id}/images?language={language}"
-    logo_response = requests.get(logo_url, headers=tmdb_headers)
-    logo_data = logo_response.json()
-    if logo_response.status_code == 200:
-        logos = logo_response.json().get("logos", [])
-        for logo in logos:
-            if logo["iso_639_1"] == "en" and logo["file_path"].endswith(".png"):
-                return logo["file_path"]
-    return None
-
-# Function to resize an image while maintaining aspect ratio
-def resize_image(image, height):
-    ratio = height / image.height
-    width = int(image.width * ratio)
-    return image.resize((width, height))
-
-# Function to resize a logo while maintaining aspect ratio
-def resize_logo(image, width, height):
-    aspect_ratio = image.width / image.height
-    new_width = width
-    new_height = int(new_width / aspect_ratio)
-    
-    if new_height > height:
-        new_height = height
-        new_width = int(new_height * aspect_ratio)
-    
-    resized_img = image.resize((new_width, new_height))
-    return resized_img
-
-# Function to get details of a TV show from TMDB
-def get_tv_show_details(tv_id):
-    tv_details_url = f'{url}tv/{tv_id}?language=en-US'
-    tv_details_response = requests.get(tv_details_url, headers=tmdb_headers)
-    return tv_details_response.json()
-
-# Function to get details of a movie from TMDB
-def get_movie_details(movie_id):
-    movie_details_url = f'{url}movie/{movie_id}?language=en-US'
-    movie_details_response = requests.get(movie_details_url, headers=tmdb_headers)
-    return movie_details_response.json()
-
-# Create a directory to save the backgrounds and clear its contents if it exists
-background_dir = "trakt_backgrounds"
-if os.path.exists(background_dir):
-    shutil.rmtree(background_dir)
-os.makedirs(background_dir, exist_ok=True)
+        year = show_data.get('first_air_date', '')[:4]
+        seasons = show_data.get('number_of_seasons', 0)
+        info = f"{genres}  •  {year}  •  {seasons} {'Season' if seasons == 1 else 'Seasons'}  •  TMDB: {tmdb_score}"
+    record = {
+        "backdrop_url": image_url,
+        "title": title,
+        "info": info,
+        "overview": show_data.get('overview'),
+    }
+    if logo:
+        record["logo"] = tmdbapi.logo_url(logo["file_path"], *renderer.image_box(layout, "logo"), logo.get("aspect_ratio"))
+    return record
 
 # Function to fetch and save background images for movies and shows
-def fetch_and_save_background_images(movies, shows):
-    directory = background_dir
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    
-    for title, tmdb_id in shows + movies:
-        if tmdb_id:
-            bckg = Image.open(os.path.join(os.path.dirname(__file__), "bckg.png"))
-            overlay = Image.open(os.path.join(os.path.dirname(__file__), "overlay.png"))
-            traktlogo = Image.open(os.path.join(os.path.dirname(__file__), "traktlogo.png"))
-
-            if title in [show[0] for show in shows]:
-                show_data = get_tv_show_details(tmdb_id)
-                media_type = "tv"
-            else:
-                show_data = get_movie_details(tmdb_id)
-                media_type = "movie"
-                
+def fetch_and_save_background_images(items, render_manifest):
+    custom_text = f"Now on my {list_name} "
+
+    layout_fingerprint = renderer.fingerprint(layout, custom_text, truetype_url)
+    script_fingerprint = manifest.file_digest(__file__)
+    backdrop_height = renderer.load_layout(layout)["backdrop"]["height"]
+
+    def jobs():
+        # Fetch the details and logos of the items concurrently, one request per item, a few items ahead of the renderers
+        items_details = tmdbapi.prefetch_iter(lambda item: (item, get_details(item[0], item[1])), items)
+        for (media_type, tmdb_id, title), show_data in items_details:
             backdrop_path = show_data.get("backdrop_path")
             if backdrop_path:
-                image_url = f"https://image.tmdb.org/t/p/original{backdrop_path}"
-                image_response = requests.get(image_url)
-                if image_response.status_code == 200:
-                    show_image = Image.open(BytesIO(image_response.content))
-                    show_image = resize_image(show_image, 1500)
-                    bckg.paste(show_image, (bckg.width - show_image.width, 0))
-                    draw = ImageDraw.Draw(bckg)
-
-                    # Text font
-                    font_title = ImageFont.truetype(urlopen(truetype_url), size=190)
-                    font_overview = ImageFont.truetype(urlopen(truetype_url), size=50)
-                    font_custom = ImageFont.truetype(urlopen(truetype_url), size=60)
-                    font_info = ImageFont.truetype(urlopen(truetype_url), size=50)
-
-                    # Text color
-                    shadow_color = "black"
-                    main_color = "white"
-                    overview_color = "white"
-                    metadata_color = (150, 150, 150)
-
-                    # Text position
-                    title_position = (200, 420)
-                    overview_position = (210, 730)
-                    shadow_offset = 2
-                    info_position = (210, 650)
-                    custom_position = (210, 870)
-
-                    #paste overlay
-                    bckg.paste(overlay, (bckg.width - overlay.width, 0), overlay)
-
-                    #paste logo and if no logo exists in english draw show title  
-                    logo_path = get_logo(media_type, tmdb_id)
-                    if logo_path:
-                        logo_url = f"https://image.tmdb.org/t/p/original{logo_path}"
-                        logo_response = requests.get(logo_url)                        
-                        try:
-                            if logo_response.status_code == 200:
-                                logo_image = Image.open(BytesIO(logo_response.content))
-                                logo_image = resize_logo(logo_image, 1000, 500)
-                                logo_image = logo_image.convert("RGBA")
-                                logo_position = (210, info_position[1] - logo_image.height - 25)
-                                bckg.paste(logo_image, logo_position, logo_image)
-                            else:
-                                print(f"Error downloading logo for {title}: status code {logo_response.status_code}")
-                                draw.text(title_position, title, fill="white", font=font_title)
-                        except UnidentifiedImageError:
-                            print(f"Error identifying logo image for {title}")
-                            draw.text(title_position, title, fill="white", font=font_title)
-                    else:
-                        draw.text(title_position, title, fill="white", font=font_title)
-
-                    #get metadata
-                    info = ""
-                    overview = ""
-                    if media_type == "movie":
-                        movie_details = get_movie_details(tmdb_id)
-                        genres = ", ".join([genre['name'] for genre in movie_details.get('genres', [])])
-                        year = movie_details.get('release_date', '')[:4]
-                        duration = movie_details.get('runtime', 0)
-                        hours, minutes = divmod(duration, 60)
-                        overview = movie_details.get('overview')
-                        tmdb_score = round(movie_details.get('vote_average', 0),1)
-                        info = f"{genres}  •  {year}  •  {hours}h{minutes}min  •  TMDB: {tmdb_score}"
-                    elif media_type == "tv":
-                        tv_details = get_tv_show_details(tmdb_id)
-                        genres = ", ".join([genre['name'] for genre in tv_details.get('genres', [])])
-                        year = tv_details.get('first_air_date', '')[:4]
-                        seasons = tv_details.get('number_of_seasons', 0)
-                        tmdb_score = round(tv_details.get('vote_average', 0),1)
-                        overview = tv_details.get('overview')
-                        info = f"{genres}  •  {year}  •  {seasons} {'Season' if seasons == 1 else 'Seasons'}  •  TMDB: {tmdb_score}"
-
-                    #draw show info
-                    draw.text((info_position[0] + shadow_offset, info_position[1] + shadow_offset), info, font=font_info, fill=shadow_color)
-                    draw.multiline_text(info_position, info, font=font_info, fill=metadata_color)
-
-                    #draw overview
-                    wrapped_overview = "\n".join(textwrap.wrap(overview, width=70, max_lines=2, placeholder=" ..."))
-                    overview_position = (210, info_position[1] + 70)
-                    draw.text((overview_position[0] + shadow_offset, overview_position[1] + shadow_offset), wrapped_overview, font=font_overview, fill=shadow_color)
-                    draw.multiline_text(overview_position, wrapped_overview, font=font_overview, fill=overview_color)
-
-                    #draw custom text and paste trakt logo
-                    custom_text = f"Now on my {list_name} "
-                    draw.text((custom_position[0] + shadow_offset, custom_position[1] + shadow_offset), custom_text, font=font_custom, fill=shadow_color)
-                    draw.text(custom_position, custom_text, font=font_custom, fill=overview_color)
-                    bckg.paste(traktlogo, (780, 885), traktlogo)
-
-                    #save image
-                    image_path = os.path.join(directory, f"{clean_filename(title)}.jpg")
-                    bckg = bckg.convert('RGB')
-                    bckg.save(image_path, "JPEG")
-                else:
-                    print(f"Error downloading image for {title}: status code {image_response.status_code}")
+                # Only PNG logos, in English
+                logo = tmdbapi.select_logo(show_data, png_only=True)
+                record = make_record(tmdbapi.backdrop_url(backdrop_path, backdrop_height), title, media_type, show_data, logo)
+
+                # Render only when the metadata, artwork, layout or this script changed since the last run
+                filename = render_manifest.claim(f"{clean_filename(title)}{encoder.extension()}", f"{media_type}-{tmdb_id}")
+                item_fingerprint = manifest.fingerprint(record, layout_fingerprint, script_fingerprint)
+                if not render_manifest.is_current(filename, item_fingerprint):
+                    yield record, filename, item_fingerprint
             else:
                 print(f"No background image found for {title}")
 
-# Fetch movie and show lists from Trakt API
-movies_list, shows_list = get_trakt_movies_and_shows(trakt_api_key, username, list_name)
+    # Render the changed wallpapers while the next items are fetched
+    results = renderer.render_jobs(layout, jobs(), render_manifest, custom_text, truetype_url)
+    print(encoder.summary(results))
+
+
+def main():
+    # Fail before any wallpaper is claimed or removed if Pillow can't write the output format
+    encoder.get_profile()
+    render_manifest = manifest.RenderManifest(background_dir)
+
+    # Fetch the movies and shows of the list from Trakt API
+    items = get_trakt_items(trakt_api_key, username, list_name)
+    if items is None:
+        # Keep the current wallpapers until the list can be fetched again
+        return
+
+    # Fetch and save background images for the movies and shows
+    fetch_and_save_background_images(items, render_manifest)
+
+    # Remove wallpapers of items that left the list
+    render_manifest.finish()
+
 
-# Fetch and save background images for the movies and shows
-fetch_and_save_background_images(movies_list, shows_list)
+if __name__ == "__main__":
+    with metrics.run("trakt"):
+        main()